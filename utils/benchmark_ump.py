@@ -0,0 +1,249 @@
+# usage: PYTHONPATH="." python utils/benchmark_ump.py [--size-mb 64] [--repeat 3] [--output ump_benchmark.json]
+#
+# Benchmarks UMP parsing and UMPFD downloading against locally generated streams.
+# Results are written as JSON so runs from different versions can be compared.
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yt_dlp
+from yt_dlp import YoutubeDL
+from yt_dlp.networking import Response
+
+from yt_dlp_plugins.extractor._ytse.downloader.ump import UMPFD
+from yt_dlp_plugins.extractor._ytse.protos.innertube.next_request_policy import NextRequestPolicy
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.format_initialization_metadata import FormatInitializationMetadata
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.media_header import MediaHeader
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.stream_protection_status import StreamProtectionStatus
+from yt_dlp_plugins.extractor._ytse.ump import UMPDecoder, UMPParser, UMPPartType, UMPWriter
+
+ITAG = 137
+SEGMENT_SIZE = 512 * 1024
+
+
+def write_ump_stream(fp, content, start=0, segment_size=SEGMENT_SIZE, rng=None, media_part_sizes=(4096, 16384, 32768, 65536)):
+    """Write content as a UMP stream with a realistic mix of media and control parts"""
+    rng = rng or random.Random(0)
+    segment_size = segment_size or len(content) or 1
+    writer = UMPWriter(fp)
+    writer.write_message(UMPPartType.STREAM_PROTECTION_STATUS, StreamProtectionStatus(status=StreamProtectionStatus.Status.OK))
+    writer.write_message(UMPPartType.FORMAT_INITIALIZATION_METADATA, FormatInitializationMetadata(video_id='benchmark'))
+    for header_id, segment_start in enumerate(range(0, len(content), segment_size)):
+        header_id %= 128
+        segment = content[segment_start:segment_start + segment_size]
+        writer.write_message(UMPPartType.MEDIA_HEADER, MediaHeader(
+            header_id=header_id, video_id='benchmark', itag=ITAG,
+            start_data_range=start + segment_start, content_length=len(segment)))
+        pos = 0
+        with memoryview(segment) as view:
+            while pos < len(segment):
+                size = rng.choice(media_part_sizes)
+                writer.write_media(header_id, view[pos:pos + size])
+                pos += size
+        writer.write_media_end(header_id)
+        writer.write_message(UMPPartType.NEXT_REQUEST_POLICY, NextRequestPolicy(
+            target_audio_readahead_ms=15000, target_video_readahead_ms=15000, backoff_time_ms=0))
+
+
+def make_content(size):
+    return random.Random(size).getrandbits(size * 8).to_bytes(size, 'little')
+
+
+def _measure(func, repeat):
+    """Run func repeat times, returning the best wall time and its result"""
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _allocations(func):
+    tracemalloc.start()
+    try:
+        func()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'peak_bytes': peak,
+        'retained_blocks': sum(stat.count for stat in snapshot.statistics('filename')),
+    }
+
+
+def benchmark_parser(stream, repeat, read_size=UMPParser.READ_SIZE, stream_part_types=()):
+    def run():
+        parser = UMPParser(
+            Response(io.BytesIO(stream), url='benchmark:', headers={}),
+            read_size=read_size, stream_part_types=stream_part_types)
+        count = 0
+        for _ in parser.iter_parts():
+            count += 1
+        return count
+
+    elapsed, parts = _measure(run, repeat)
+    return {
+        'name': 'parser' + ('_streamed_media' if stream_part_types else ''),
+        'read_size': read_size,
+        'bytes': len(stream),
+        'parts': parts,
+        'seconds': elapsed,
+        'mb_per_s': len(stream) / elapsed / 1e6,
+        'parts_per_s': parts / elapsed,
+        'allocations': _allocations(run),
+    }
+
+
+def benchmark_decoder(stream, repeat, feed_size):
+    def run():
+        decoder = UMPDecoder()
+        count = 0
+        with memoryview(stream) as view:
+            for pos in range(0, len(stream), feed_size):
+                count += len(decoder.feed(view[pos:pos + feed_size]))
+        return count
+
+    elapsed, parts = _measure(run, repeat)
+    return {
+        'name': 'decoder',
+        'feed_size': feed_size,
+        'bytes': len(stream),
+        'parts': parts,
+        'seconds': elapsed,
+        'mb_per_s': len(stream) / elapsed / 1e6,
+        'parts_per_s': parts / elapsed,
+    }
+
+
+class _UMPRequestHandler(BaseHTTPRequestHandler):
+    """Serves the server's content as UMP, honouring the range query parameter like googlevideo"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+        content = self.server.content
+        start, _, end = query.get('range', '0-').partition('-')
+        start, end = int(start), min(int(end or len(content) - 1), len(content) - 1)
+
+        # Like googlevideo, respond to a range request with a single media segment
+        body = io.BytesIO()
+        write_ump_stream(body, content[start:end + 1], start=start, segment_size=None)
+        body = body.getbuffer()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.yt-ump')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except ConnectionError:
+            # The downloader may close the connection once it has all the media it needs
+            pass
+
+
+def benchmark_download(content, repeat, params=None):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _UMPRequestHandler)
+    server.content = content
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    tmpdir = tempfile.mkdtemp(prefix='ytse-benchmark-')
+    params = {'quiet': True, 'no_warnings': True, 'noprogress': True, 'http_chunk_size': 10 * 1024 * 1024, **(params or {})}
+
+    def run():
+        filename = os.path.join(tmpdir, 'benchmark.mp4')
+        if os.path.exists(filename):
+            os.remove(filename)
+        with YoutubeDL(dict(params)) as ydl:
+            UMPFD(ydl, ydl.params).download(filename, {
+                'url': f'http://127.0.0.1:{server.server_port}/videoplayback?ump=1',
+                'filesize': len(content),
+                'http_headers': {},
+            })
+        if os.path.getsize(filename) != len(content):
+            raise AssertionError('Downloaded file size does not match')
+
+    try:
+        elapsed, _ = _measure(run, repeat)
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return {
+        'name': 'download',
+        'params': {k: v for k, v in params.items() if k not in ('quiet', 'no_warnings', 'noprogress')},
+        'bytes': len(content),
+        'seconds': elapsed,
+        'mb_per_s': len(content) / elapsed / 1e6,
+    }
+
+
+def run_benchmarks(size, repeat, download=True):
+    content = make_content(size)
+    stream = io.BytesIO()
+    write_ump_stream(stream, content)
+    stream = stream.getvalue()
+
+    results = [
+        benchmark_parser(stream, repeat),
+        benchmark_parser(stream, repeat, stream_part_types=(UMPPartType.MEDIA,)),
+        benchmark_parser(stream, repeat, read_size=16 * 1024),
+        benchmark_decoder(stream, repeat, feed_size=1500),
+        benchmark_decoder(stream, repeat, feed_size=64 * 1024),
+    ]
+    if download:
+        results.append(benchmark_download(content, repeat))
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=64, help='amount of media data to generate')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark; the fastest is reported')
+    parser.add_argument('--output', default='ump_benchmark.json', help='file to write the JSON results to')
+    parser.add_argument('--no-download', action='store_true', help='skip the end-to-end UMPFD benchmark')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.size_mb * 1024 * 1024, args.repeat, download=not args.no_download)
+    for result in results:
+        label = f'{result["name"]} ({result.get("read_size") or result.get("feed_size") or ""})'
+        print(f'{label:<32} {result["mb_per_s"]:>10.1f} MB/s'
+              + (f' {result["parts_per_s"]:>12.0f} parts/s' if 'parts_per_s' in result else ''))
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'timestamp': time.time(),
+            'git_revision': git_revision(),
+            'yt_dlp_version': yt_dlp.version.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'size': args.size_mb * 1024 * 1024,
+            'results': results,
+        }, f, indent=2)
+    print(f'Results written to {args.output}')
@@ -1,9 +1,14 @@
 import base64
+import concurrent.futures
+import contextlib
+import itertools
 import os
 import random
+import threading
 import time
-import protobug
-from yt_dlp import DownloadError, traverse_obj
+import urllib.parse
+import zlib
+from yt_dlp import DownloadError
 
 from yt_dlp.downloader.common import FileDownloader
 from yt_dlp.networking import Request
@@ -21,26 +26,366 @@ from yt_dlp.utils import (
     encodeFilename,
     parse_http_range,
     try_call,
+    float_or_none,
     int_or_none,
+    parse_bytes,
+    parse_qs,
+    traverse_obj,
     write_xattr,
 )
 from yt_dlp.utils.networking import HTTPHeaderDict
+from yt_dlp_plugins.extractor._ytse.downloader.ump_budget import download_budget
+from yt_dlp_plugins.extractor._ytse.downloader.ump_journal import UMPJournal
+from yt_dlp_plugins.extractor._ytse.downloader.ump_output import UMPOutputFile
+from yt_dlp_plugins.extractor._ytse.downloader.ump_redirects import redirect_cache
 from yt_dlp_plugins.extractor._ytse.ump import UMPParser, UMPPartType
 
-from yt_dlp_plugins.extractor._ytse.protos.videostreaming.media_header import MediaHeader
-from yt_dlp_plugins.extractor._ytse.protos.videostreaming.sabr_redirect import SabrRedirect
+from yt_dlp_plugins.extractor._ytse.protos.innertube.compression_algorithm import CompressionAlgorithm
 from yt_dlp_plugins.extractor._ytse.protos.videostreaming.stream_protection_status import StreamProtectionStatus
-from yt_dlp_plugins.extractor._ytse.protos.videostreaming.sabr_error import SabrError
+
+
+class _RetryRange(Exception):
+    def __init__(self, source_error):
+        self.source_error = source_error
+
+
+class _BufferedResponse:
+    """Wraps a response whose first bytes have already been read"""
+
+    def __init__(self, response, head):
+        self.response = response
+        self.head = head
+        self.headers = response.headers
+        self.status = response.status
+        self.url = response.url
+
+    def read(self, amt=None):
+        if not self.head:
+            return self.response.read(amt)
+        if amt is None:
+            data, self.head = self.head + self.response.read(), b''
+        else:
+            data, self.head = self.head[:amt], self.head[amt:]
+        return data
+
+    def close(self):
+        self.head = b''
+        self.response.close()
+
+
+class _ChunkSizer:
+    """
+    Sizes each range request from the measured throughput and time-to-first-byte of previous requests.
+
+    Ranges are sized to take about TARGET_SECONDS to receive, or longer when the time-to-first-byte is high
+    so that it stays a small part of each request. Sizes change by at most a factor of 2 per request.
+    """
+    TARGET_SECONDS = 4
+    # Time-to-first-byte should be at most 1/TTFB_RATIO of the request time
+    TTFB_RATIO = 10
+    # Weight of the latest measurement in the smoothed throughput
+    SMOOTHING = 0.5
+
+    def __init__(self, initial_size, min_size, max_size):
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size)
+        self.size = self._clamp(initial_size)
+        self.throughput = None
+
+    def _clamp(self, size):
+        return int(min(max(size, self.min_size), self.max_size))
+
+    def record(self, byte_count, elapsed, ttfb):
+        """Record a completed request of byte_count bytes that took elapsed seconds, ttfb of which was waiting"""
+        transfer_time = elapsed - ttfb
+        if byte_count <= 0 or transfer_time <= 0:
+            return
+        throughput = byte_count / transfer_time
+        self.throughput = throughput if self.throughput is None else (
+            self.SMOOTHING * throughput + (1 - self.SMOOTHING) * self.throughput)
+        target = self.throughput * max(self.TARGET_SECONDS, ttfb * self.TTFB_RATIO)
+        self.size = self._clamp(min(max(target, self.size / 2), self.size * 2))
+
+    def failed(self):
+        """Shrink ranges after a failed request, so that retries are cheaper"""
+        self.size = self._clamp(self.size / 2)
+
+
+class _RequestScheduler:
+    """Times and sizes range requests according to the NextRequestPolicy parts sent by the server"""
+
+    def __init__(self, info_dict):
+        self.is_audio = info_dict.get('vcodec') == 'none'
+        # bytes per second
+        self.bitrate = (
+            (info_dict.get('tbr') or 0) * 1000 / 8
+            or (info_dict.get('filesize') or 0) / (info_dict.get('duration') or float('inf')))
+        self.policy = None
+        self.next_request_time = 0
+
+    def update(self, policy):
+        self.policy = policy
+        backoff_ms = policy.backoff_time_ms
+        if backoff_ms:
+            # Do not wait so long that the server considers the client gone
+            if policy.max_time_since_last_request_ms:
+                backoff_ms = min(backoff_ms, policy.max_time_since_last_request_ms)
+            self.next_request_time = max(self.next_request_time, time.time() + backoff_ms / 1000)
+
+    def delay(self):
+        """Seconds to wait before making the next request"""
+        return max(self.next_request_time - time.time(), 0)
+
+    def range_size(self, size):
+        """Grow a range size to cover the readahead the server asked for"""
+        if not size or not self.policy or not self.bitrate:
+            return size
+        readahead_ms = (
+            self.policy.target_audio_readahead_ms if self.is_audio
+            else self.policy.target_video_readahead_ms) or 0
+        return max(size, int(self.bitrate * readahead_ms / 1000))
+
+
+class _ProgressCoalescer:
+    """Limits progress updates to one per interval seconds, or per byte_threshold bytes if set"""
+
+    def __init__(self, interval, byte_threshold=None):
+        self.interval = interval
+        self.byte_threshold = byte_threshold
+        self.reported_bytes = 0
+        self.reported_time = 0
+
+    def due(self, byte_counter) -> bool:
+        """Whether a progress update should be sent for byte_counter. If so, it is recorded as sent"""
+        now = time.monotonic()
+        if now - self.reported_time < self.interval and not (
+                self.byte_threshold and byte_counter - self.reported_bytes >= self.byte_threshold):
+            return False
+        self.reported_bytes, self.reported_time = byte_counter, now
+        return True
+
+    def pending(self, byte_counter) -> bool:
+        """Whether there is progress that has not been sent yet"""
+        return byte_counter != self.reported_bytes
+
+
+class _MediaDemuxer:
+    """
+    Matches MEDIA parts to their format through the header_id of the MediaHeader that precedes them.
+    Media of formats other than the one being downloaded is dropped rather than written to the file.
+    Media of headers with gzip compression is decompressed as it is received.
+    """
+
+    def __init__(self, itag=None):
+        self.itag = itag
+        self.headers = {}
+        self._decompressors = {}
+        # Whether the MEDIA part currently being received is for this format, and its decompressor
+        self._accept = True
+        self._decompressor = None
+        # header_id and MediaHeader (if known) of the MEDIA part currently being received
+        self.header_id = None
+        self.header = None
+
+    def add_header(self, header):
+        self.headers[header.header_id] = header
+        if header.compression == CompressionAlgorithm.COMPRESSION_ALGORITHM_GZIP:
+            # The compressed stream of a header may be split over several MEDIA parts
+            self._decompressors[header.header_id] = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    def accepts(self, header_id):
+        """Whether the media of header_id is for this format"""
+        header = self.headers.get(header_id)
+        # Without a MediaHeader (or itag) to go by, the media is assumed to be for this format
+        return not (self.itag and header and header.itag and header.itag != self.itag)
+
+    def media_data(self, part):
+        """The media data of a MEDIA part chunk, or None if it belongs to another format"""
+        if part.is_first:
+            header_id = self.header_id = part.data[0]
+            self.header = self.headers.get(header_id)
+            self._accept = self.accepts(header_id)
+            self._decompressor = self._decompressors.get(header_id)
+            data = part.data[1:]
+        else:
+            data = part.data
+        if not self._accept:
+            return None
+        if self._decompressor is not None:
+            try:
+                return self._decompressor.decompress(data)
+            except zlib.error as err:
+                raise _RetryRange(Exception(f'Unable to decompress media: {err}'))
+        return data
 
 
 class UMPFD(FileDownloader):
+    # Unread data is drained up to this size when a response is finished with, so that the
+    # request handler can return the connection to its pool for the next range request
+    _DRAIN_LIMIT = 256 * 1024
+    # With pipelining, the next range is requested once this fraction of the current one has been received,
+    # and up to _PIPELINE_HEAD_SIZE bytes of its response are read ahead
+    _PIPELINE_THRESHOLD = 0.75
+    _PIPELINE_HEAD_SIZE = 64 * 1024
+    # Initial range size and default bounds for adaptive chunk sizing
+    _ADAPTIVE_CHUNK_SIZE = 1024 * 1024
+    _ADAPTIVE_CHUNK_MIN = 256 * 1024
+    _ADAPTIVE_CHUNK_MAX = 50 * 1024 * 1024
+    # Minimum time between progress updates, unless overridden
+    _PROGRESS_INTERVAL = 0.2
+    # Bytes of part data included in warnings, unless ump_debug is enabled
+    _WARNING_DATA_PREVIEW = 48
+    # Minimum time between prewarming connections to the same host
+    _PREWARM_INTERVAL = 30
+    # Live streams: assumed segment duration until one is received, and how long
+    # the head of the stream may stay the same before the stream is considered ended
+    _LIVE_SEGMENT_DURATION = 5
+    _LIVE_END_TIMEOUT = 60
+
+    def __init__(self, ydl, params):
+        super().__init__(ydl, params)
+        # Resolved once; callers check this before formatting debug messages so that it costs nothing when disabled
+        self._ump_debug = int_or_none(self._get_extractor_arg('ump_debug')) == 1
+        self._redirect_cache = None if int_or_none(self._get_extractor_arg('ump_redirect_cache')) == 0 else redirect_cache
+        self._ump_warned = set()
+        self._prewarmed = {}
+        self._prewarm_lock = threading.Lock()
+        # The budget is shared by all UMP downloads in the process
+        self._budget = download_budget
+        # Only the limits that are given are changed; others stay as a previous downloader set them
+        global_rate = self._get_extractor_arg('ump_global_ratelimit')
+        host_connections = int_or_none(self._get_extractor_arg('ump_host_connections'))
+        self._budget.configure(None if global_rate is None else parse_bytes(global_rate), host_connections)
+
+    def _get_extractor_arg(self, key):
+        return traverse_obj(self.ydl.params, ('extractor_args', 'youtube', key, 0), get_all=False)
+
+    def _progress_coalescer(self):
+        interval = float_or_none(self._get_extractor_arg('ump_progress_interval'))
+        byte_threshold = parse_bytes(self._get_extractor_arg('ump_progress_bytes') or '')
+        if byte_threshold and interval is None:
+            # Only the byte threshold was set
+            interval = float('inf')
+        return _ProgressCoalescer(self._PROGRESS_INTERVAL if interval is None else interval, byte_threshold)
 
     def write_ump_debug(self, part, message):
-        if traverse_obj(self.ydl.params, ('extractor_args', 'youtube', 'ump_debug', 0, {int_or_none}), get_all=False) == 1:
+        if self._ump_debug:
             self.write_debug(f'[{part.part_type.name}]: (Size {part.size}) {message}')
 
     def write_ump_warning(self, part, message):
-        self.report_warning(f'[{part.part_type.name}]: (Size {part.size}) {message}')
+        """Warn about a part, with a preview of its data. Repeated warnings are only shown with ump_debug"""
+        key = (part.part_id, message)
+        if key in self._ump_warned and not self._ump_debug:
+            return
+        self._ump_warned.add(key)
+        data = part.data if self._ump_debug else part.data[:self._WARNING_DATA_PREVIEW]
+        preview = base64.b64encode(data).decode()
+        if len(data) < part.size:
+            preview += '...'
+        self.report_warning(f'[{part.part_type.name}]: (Size {part.size}) {message} Data: {preview}')
+
+    def _request_headers(self, info_dict):
+        # Compression is disabled unless requested, in which case the request handler decompresses the response
+        encoding = 'gzip, deflate' if int_or_none(self._get_extractor_arg('ump_compression')) == 1 else 'identity'
+        return HTTPHeaderDict({'Accept-Encoding': encoding, 'Accept': '*/*'}, info_dict.get('http_headers'))
+
+    def _init_url(self, ctx, url):
+        """Start the download of url from its cached redirect, if there is one"""
+        ctx.url, ctx.redirect_key, ctx.cached_redirect_url = url, None, None
+        if self._redirect_cache is None:
+            return
+        ctx.redirect_key = self._redirect_cache.key(url)
+        cached_url = self._redirect_cache.get(self.ydl, ctx.redirect_key)
+        if cached_url:
+            self.write_debug('Using cached SABR redirect')
+            ctx.url = ctx.cached_redirect_url = cached_url
+
+    def _follow_redirect(self, ctx, redirect_url):
+        ctx.url = redirect_url
+        if ctx.journal is not None:
+            ctx.journal.url = redirect_url
+        if ctx.redirect_key is not None:
+            self._redirect_cache.store(self.ydl, ctx.redirect_key, redirect_url)
+
+    @staticmethod
+    def _url_expired(url, margin=60):
+        expire = int_or_none(traverse_obj(parse_qs(url), ('expire', 0)))
+        return expire is not None and expire - margin <= time.time()
+
+    def _drop_cached_redirect(self, ctx, url, failed_url):
+        """If failed_url is a cached redirect, forget it and go back to url. Returns whether it was"""
+        if ctx.cached_redirect_url is None or failed_url != ctx.cached_redirect_url:
+            return False
+        self.write_debug('Cached SABR redirect failed; using the original URL')
+        if self._redirect_cache is not None and ctx.redirect_key is not None:
+            self._redirect_cache.remove(self.ydl, ctx.redirect_key)
+        if ctx.journal is not None and ctx.journal.url == failed_url:
+            ctx.journal.url = None
+        if ctx.url == failed_url:
+            ctx.url = url
+        return True
+
+    @staticmethod
+    def _format_itag(info_dict):
+        return int_or_none(traverse_obj(parse_qs(info_dict['url']), ('itag', 0)))
+
+    def _release_response(self, response):
+        """Drain and close a response so its connection can be reused (by handlers that pool connections, e.g. requests)"""
+        remaining = self._DRAIN_LIMIT
+        try:
+            while remaining > 0:
+                data = response.read(min(remaining, 64 * 1024))
+                if not data:
+                    break
+                remaining -= len(data)
+        except TransportError:
+            pass
+        finally:
+            response.close()
+
+    def _prewarm_connection(self, url):
+        """Open a connection to url in the background, so a later request to its host can reuse it (if the request handler pools connections)"""
+        host = urllib.parse.urlparse(url).netloc
+        now = time.monotonic()
+        with self._prewarm_lock:
+            if not host or now - self._prewarmed.get(host, -self._PREWARM_INTERVAL) < self._PREWARM_INTERVAL:
+                return
+            self._prewarmed[host] = now
+
+        def prewarm():
+            try:
+                self._release_response(self.ydl.urlopen(Request(url)))
+            except (HTTPError, TransportError) as err:
+                self.write_debug(f'Unable to prewarm connection to {host}: {err}')
+
+        threading.Thread(target=prewarm, daemon=True).start()
+
+    def _handle_connection_hint(self, part):
+        if part.part_type == UMPPartType.PREWARM_CONNECTION:
+            prewarm_url = part.message.prewarm_connection_url
+            if self._ump_debug:
+                self.write_ump_debug(part, f'Prewarm URL: {prewarm_url}')
+            if prewarm_url:
+                self._prewarm_connection(prewarm_url)
+        elif self._ump_debug:
+            # The payload of HOSTNAME_CHANGE_HINT is not known, so there is no host to prewarm
+            self.write_ump_debug(part, f'Data: {part.get_b64_str()}')
+
+    def _open_output(self, tmpfilename, open_mode):
+        """Open the temp file. Unlike sanitize_open, this supports 'r+b' for writing at offsets in an existing file"""
+        if open_mode != 'r+b':
+            return self.sanitize_open(tmpfilename, open_mode)
+        # sanitize_open (through locked_file) only supports read, append and write modes.
+        # A file being resumed was opened with it before, so its name is already sanitized
+        return open(encodeFilename(tmpfilename), 'r+b'), tmpfilename
+
+    def _prefetch_response(self, request):
+        response = self.ydl.urlopen(request)
+        try:
+            return _BufferedResponse(response, response.read(self._PIPELINE_HEAD_SIZE))
+        except BaseException:
+            response.close()
+            raise
 
     def real_download(self, filename, info_dict):
         url = info_dict['url']
@@ -55,8 +400,7 @@ class UMPFD(FileDownloader):
         ctx.tmpfilename = self.temp_name(filename)
         ctx.stream = None
 
-        # Disable compression
-        headers = HTTPHeaderDict({'Accept-Encoding': 'identity', 'Accept': '*/*'}, info_dict.get('http_headers'))
+        headers = self._request_headers(info_dict)
 
         is_test = self.params.get('test', False)
         chunk_size = self._TEST_FILE_SIZE if is_test else (
@@ -64,6 +408,15 @@ class UMPFD(FileDownloader):
             or info_dict.get('downloader_options', {}).get('http_chunk_size')
             or 0)
 
+        # Opt-in: size each range from the throughput of previous requests
+        chunk_sizer = None
+        if not is_test and int_or_none(self._get_extractor_arg('ump_chunk_adaptive')) == 1:
+            chunk_sizer = _ChunkSizer(
+                chunk_size or self._ADAPTIVE_CHUNK_SIZE,
+                parse_bytes(self._get_extractor_arg('ump_chunk_min') or '') or self._ADAPTIVE_CHUNK_MIN,
+                parse_bytes(self._get_extractor_arg('ump_chunk_max') or '') or self._ADAPTIVE_CHUNK_MAX)
+            chunk_size = chunk_sizer.size
+
         ctx.open_mode = 'wb'
         ctx.resume_len = 0
         ctx.start_time = time.time()
@@ -72,15 +425,46 @@ class UMPFD(FileDownloader):
 
         ctx.data_len = ctx.content_len = info_dict.get('filesize', None)
 
-        ctx.url = url
+        self._init_url(ctx, url)
+        itag = self._format_itag(info_dict)
+        ctx.scheduler = _RequestScheduler(info_dict)
+        ctx.progress = self._progress_coalescer()
+        request_data = info_dict.get('request_data', b'x\0')
+
+        # Opt-in: request the next range while the current one is still being received
+        pipeline = bool(chunk_size) and not is_test and int_or_none(self._get_extractor_arg('ump_pipeline')) == 1
+        ctx.prefetch = None
+        ctx.prefetch_pool = None
 
         if not ctx.data_len:
+            if info_dict.get('is_live'):
+                return self._download_live(ctx, info_dict, headers)
             raise DownloadError('Missing filesize')
 
         # parse given Range
         req_start, req_end, _ = parse_http_range(headers.get('Range'))
 
-        if self.params.get('continuedl', True):
+        # The ranges on disk are journaled, so that the download can be resumed even if it was written out of order
+        ctx.journal = None
+        if not is_test and ctx.tmpfilename != '-' and req_start is None and req_end is None:
+            ctx.journal = UMPJournal(ctx.filename)
+            if self.params.get('continuedl', True) and ctx.journal.load(ctx.content_len, encodeFilename(ctx.tmpfilename)):
+                if ctx.journal.url and not self._url_expired(ctx.journal.url):
+                    # Treated like a cached redirect, so the original URL is used again if it no longer works
+                    ctx.url = ctx.cached_redirect_url = ctx.journal.url
+                ctx.request_number = ctx.journal.request_number
+            else:
+                ctx.journal.reset(ctx.content_len)
+
+        concurrency = self.params.get('concurrent_fragment_downloads') or 1
+        if ctx.journal is not None and (
+                concurrency > 1 or ctx.journal.missing() != [(ctx.journal.contiguous_end, ctx.content_len)]):
+            # Unless only the end of the file is missing, the download is resumed by range
+            return self._download_ranges(ctx, info_dict, headers, chunk_size, concurrency)
+
+        if ctx.journal is not None:
+            ctx.resume_len = ctx.journal.contiguous_end
+        elif self.params.get('continuedl', True):
             # Establish possible resume length
             if os.path.isfile(encodeFilename(ctx.tmpfilename)):
                 ctx.resume_len = os.path.getsize(
@@ -98,9 +482,67 @@ class UMPFD(FileDownloader):
         class NextFragment(Exception):
             pass
 
+        def next_request_number():
+            ctx.request_number += 1
+            if ctx.journal is not None:
+                ctx.journal.request_number = ctx.request_number
+            return ctx.request_number
+
+        def start_over():
+            ctx.resume_len = 0
+            ctx.open_mode = 'wb'
+            if ctx.journal is not None:
+                ctx.journal.reset(ctx.content_len)
+
+        def next_chunk_size():
+            size = ctx.scheduler.range_size(chunk_sizer.size if chunk_sizer else chunk_size)
+            return random.randint(int(size * 0.95), size) if not is_test and size else size
+
+        def prefetch_next_range():
+            range_start = ctx.range_end + 1
+            range_end = ctx.content_len - 1 if req_end is None else min(req_end, ctx.content_len - 1)
+            if range_start > range_end:
+                return
+            prefetch_chunk_size = next_chunk_size()
+            range_end = min(range_start + prefetch_chunk_size - 1, range_end)
+            request = Request(ctx.url, request_data, headers, query={
+                'range': f'{range_start}-{range_end}', 'rn': next_request_number(), 'ump': 1, 'srfvp': 1})
+            if ctx.prefetch_pool is None:
+                ctx.prefetch_pool = concurrent.futures.ThreadPoolExecutor(1)
+            ctx.prefetch = (range_start, range_end, prefetch_chunk_size, ctx.url,
+                            ctx.prefetch_pool.submit(self._prefetch_response, request))
+
+        def discard_prefetch():
+            if ctx.prefetch is None:
+                return
+            future = ctx.prefetch[-1]
+            ctx.prefetch = None
+            future.cancel()
+            future.add_done_callback(
+                lambda f: f.cancelled() or f.exception() is not None or f.result().close())
+
+        def use_prefetch(range_start):
+            """Use the pipelined response if it is for range_start. Returns whether it was used"""
+            if ctx.prefetch is None:
+                return False
+            prefetch_start, range_end, prefetch_chunk_size, prefetch_url, future = ctx.prefetch
+            if (prefetch_start, prefetch_url) != (range_start, ctx.url):
+                discard_prefetch()
+                return False
+            ctx.prefetch = None
+            try:
+                ctx.data = future.result()
+            except (HTTPError, TransportError) as err:
+                # Retried as a normal request
+                self.write_debug(f'Pipelined request failed: {err}')
+                return False
+            ctx.chunk_size, ctx.range_end = prefetch_chunk_size, range_end
+            # The time-to-first-byte was hidden by the pipelining
+            ctx.request_start, ctx.ttfb = time.time(), 0
+            return True
+
         def establish_connection():
-            ctx.chunk_size = (random.randint(int(chunk_size * 0.95), chunk_size)
-                              if not is_test and chunk_size else chunk_size)
+            ctx.chunk_size = next_chunk_size()
             if ctx.resume_len > 0:
                 range_start = ctx.resume_len
                 if req_start is not None:
@@ -108,7 +550,7 @@ class UMPFD(FileDownloader):
                     range_start += req_start
                 if ctx.is_resume:
                     self.report_resuming_byte(ctx.resume_len)
-                ctx.open_mode = 'ab'
+                ctx.open_mode = 'r+b'
             elif req_start is not None:
                 range_start = req_start
             elif ctx.chunk_size > 0:
@@ -117,6 +559,9 @@ class UMPFD(FileDownloader):
                 range_start = None
             ctx.is_resume = False
 
+            if range_start is not None and use_prefetch(range_start):
+                return
+
             if ctx.chunk_size:
                 chunk_aware_end = range_start + ctx.chunk_size - 1
                 # we're not allowed to download outside Range
@@ -128,21 +573,27 @@ class UMPFD(FileDownloader):
                 range_end = None
 
             if try_call(lambda: range_start > range_end):
-                ctx.resume_len = 0
-                ctx.open_mode = 'wb'
+                start_over()
                 raise RetryDownload(Exception(f'Conflicting range. (start={range_start} > end={range_end})'))
 
             if try_call(lambda: range_end >= ctx.content_len):
                 range_end = ctx.content_len - 1
 
+            ctx.range_end = range_end
             range = f'{int(range_start)}-{int_or_none(range_end) or ""}'
-            request_data = info_dict.get('request_data', b'x\0')
 
-            ctx.request_number += 1
-            request = Request(ctx.url, request_data, headers, query={'range': range, 'rn': ctx.request_number, 'ump': 1, 'srfvp': 1})
+            request = Request(ctx.url, request_data, headers, query={'range': range, 'rn': next_request_number(), 'ump': 1, 'srfvp': 1})
+            delay = ctx.scheduler.delay()
+            if delay:
+                self.write_debug(f'Waiting {delay:.2f}s before the next request, as requested by the server')
+                time.sleep(delay)
+
             # Establish connection
+            request_url = ctx.url
             try:
+                ctx.request_start = time.time()
                 ctx.data = self.ydl.urlopen(request)
+                ctx.ttfb = time.time() - ctx.request_start
             except HTTPError as err:
                 if err.status == 416:
                     # Unable to resume (requested range not satisfiable)
@@ -166,6 +617,8 @@ class UMPFD(FileDownloader):
                             # completely downloaded if the file size differs less than 100 bytes from
                             # the one in the hard drive.
                             self.report_file_already_downloaded(ctx.filename)
+                            if ctx.journal is not None:
+                                ctx.journal.remove()
                             self.try_rename(ctx.tmpfilename, ctx.filename)
                             self._hook_progress({
                                 'filename': ctx.filename,
@@ -177,10 +630,12 @@ class UMPFD(FileDownloader):
                         else:
                             # The length does not match, we start the download over
                             self.report_unable_to_resume()
-                            ctx.resume_len = 0
-                            ctx.open_mode = 'wb'
+                            start_over()
                             return
                 if err.status < 500 or err.status >= 600:
+                    if self._drop_cached_redirect(ctx, url, request_url):
+                        # Retry from the original URL without using up an attempt
+                        raise NextFragment
                     # Unexpected HTTP error
                     raise
                 raise RetryDownload(err)
@@ -191,9 +646,15 @@ class UMPFD(FileDownloader):
 
         def close_stream():
             if ctx.stream is not None:
-                if ctx.tmpfilename != '-':
-                    ctx.stream.close()
-                ctx.stream = None
+                try:
+                    ctx.stream.flush()
+                    if ctx.tmpfilename != '-':
+                        # Drop any preallocated space past the written data, so that the file size can be resumed from
+                        ctx.output.truncate(ctx.stream.position)
+                finally:
+                    if ctx.tmpfilename != '-':
+                        ctx.output.close()
+                    ctx.stream = None
 
         def download():
             data_len = None
@@ -227,6 +688,8 @@ class UMPFD(FileDownloader):
                 close_stream()
                 if ctx.tmpfilename == '-':
                     ctx.resume_len = byte_counter
+                elif ctx.journal is not None:
+                    ctx.resume_len = ctx.journal.contiguous_end
                 else:
                     try:
                         ctx.resume_len = os.path.getsize(encodeFilename(ctx.tmpfilename))
@@ -234,51 +697,102 @@ class UMPFD(FileDownloader):
                         ctx.resume_len = 0
                 raise RetryDownload(e)
 
-            ump = UMPParser(ctx.data)
+            def report_progress():
+                nonlocal now
+                # Apply rate limit
+                self.slow_down(start, now, byte_counter - ctx.resume_len)
+
+                # end measuring of one loop run
+                now = time.time()
+
+                # Progress message
+                speed = self.calc_speed(start, now, byte_counter - ctx.resume_len)
+                if ctx.data_len is None:
+                    eta = None
+                else:
+                    eta = self.calc_eta(start, time.time(), ctx.data_len - ctx.resume_len, byte_counter - ctx.resume_len)
+
+                self._hook_progress({
+                    'status': 'downloading',
+                    'downloaded_bytes': byte_counter,
+                    'total_bytes': ctx.data_len,
+                    'tmpfilename': ctx.tmpfilename,
+                    'filename': ctx.filename,
+                    'eta': eta,
+                    'speed': speed,
+                    'elapsed': now - ctx.start_time,
+                    'ctx_id': info_dict.get('ctx_id'),
+                }, info_dict)
+                return speed
+
+            # MEDIA parts are streamed in chunks so that they can be written out without buffering the whole part
+            ump = UMPParser(ctx.data, stream_part_types=(UMPPartType.MEDIA,))
+            demuxer = _MediaDemuxer(itag)
             for part in ump.iter_parts():
                 if part.part_type == UMPPartType.MEDIA_HEADER:
-                    media_header = protobug.loads(part.data, MediaHeader)
-                    self.write_ump_debug(part, f'Parsed header: {media_header} Data: {part.get_b64_str()}')
+                    if self._ump_debug:
+                        self.write_ump_debug(part, f'Parsed header: {part.message} Data: {part.get_b64_str()}')
+                    demuxer.add_header(part.message)
                     continue
 
                 elif part.part_type == UMPPartType.MEDIA_END:
-                    self.write_ump_debug(part, f' Header ID: {part.data[0]}')
-                    break
+                    if self._ump_debug:
+                        self.write_ump_debug(part, f' Header ID: {part.data[0]}')
+                    # The end of media of another format does not end this response
+                    if demuxer.accepts(part.data[0]):
+                        break
                 elif part.part_type == UMPPartType.STREAM_PROTECTION_STATUS:
-                    sps = protobug.loads(part.data, StreamProtectionStatus)
-                    self.write_ump_debug(part, f'Status: {StreamProtectionStatus.Status(sps.status).name} Data: {part.get_b64_str()}')
+                    sps = part.message
+                    if self._ump_debug:
+                        self.write_ump_debug(part, f'Status: {StreamProtectionStatus.Status(sps.status).name} Data: {part.get_b64_str()}')
                     if sps.status == StreamProtectionStatus.Status.ATTESTATION_REQUIRED:
                         ctx.data.close()
                         self.report_error('StreamProtectionStatus: Attestation Required (missing PO Token?)')
                         return False
 
                 elif part.part_type == UMPPartType.SABR_REDIRECT:
-                    sabr_redirect = protobug.loads(part.data, SabrRedirect)
-                    ctx.url = sabr_redirect.redirect_url
-                    self.write_ump_debug(part, f'New URL: {ctx.url}')
-                    if not ctx.url:
+                    redirect_url = part.message.redirect_url
+                    if self._ump_debug:
+                        self.write_ump_debug(part, f'New URL: {redirect_url}')
+                    if not redirect_url:
                         ctx.data.close()
                         self.report_error('SABRRedirect: Invalid redirect URL')
                         return False
+                    self._follow_redirect(ctx, redirect_url)
+                    self._release_response(ctx.data)
                     raise NextFragment
 
                 elif part.part_type == UMPPartType.MEDIA:
-                    self.write_ump_debug(part, f'Header ID: {part.data[0]}')
-
-                    data_block = part.data[1:]
-                    byte_counter += len(data_block)
                     # exit loop when download is finished
-                    if len(data_block) == 0:
+                    if part.size <= 1:
                         break
 
+                    if part.is_first and self._ump_debug:
+                        self.write_ump_debug(part, f'Header ID: {part.data[0]}')
+                    try:
+                        data_block = demuxer.media_data(part)
+                    except _RetryRange as err:
+                        ctx.data.close()
+                        retry(err.source_error)
+
+                    if not data_block:
+                        continue
+                    byte_counter += len(data_block)
+                    self._budget.throttle(len(data_block))
+
                     # Open destination file just in time
                     if ctx.stream is None:
                         try:
-                            ctx.stream, ctx.tmpfilename = self.sanitize_open(
+                            stream, ctx.tmpfilename = self._open_output(
                                 ctx.tmpfilename, ctx.open_mode)
-                            assert ctx.stream is not None
+                            assert stream is not None
                             ctx.filename = self.undo_temp_name(ctx.tmpfilename)
                             self.report_destination(ctx.filename)
+                            # The file is kept open across requests, and small media blocks are coalesced into larger writes
+                            ctx.output = UMPOutputFile(stream, seekable=ctx.tmpfilename != '-', journal=ctx.journal)
+                            if not is_test and req_start is None and req_end is None:
+                                ctx.output.preallocate(ctx.content_len)
+                            ctx.stream = ctx.output.writer(ctx.resume_len)
                         except OSError as err:
                             self.report_error(f'unable to open for writing: {err}')
                             return False
@@ -296,62 +810,58 @@ class UMPFD(FileDownloader):
                         self.report_error(f'unable to write data: {err}')
                         return False
 
-                    # Apply rate limit
-                    self.slow_down(start, now, byte_counter - ctx.resume_len)
-
-                    # end measuring of one loop run
-                    now = time.time()
-
-                    # Progress message
-                    speed = self.calc_speed(start, now, byte_counter - ctx.resume_len)
-                    if ctx.data_len is None:
-                        eta = None
-                    else:
-                        eta = self.calc_eta(start, time.time(), ctx.data_len - ctx.resume_len, byte_counter - ctx.resume_len)
-
-                    self._hook_progress({
-                        'status': 'downloading',
-                        'downloaded_bytes': byte_counter,
-                        'total_bytes': ctx.data_len,
-                        'tmpfilename': ctx.tmpfilename,
-                        'filename': ctx.filename,
-                        'eta': eta,
-                        'speed': speed,
-                        'elapsed': now - ctx.start_time,
-                        'ctx_id': info_dict.get('ctx_id'),
-                    }, info_dict)
-
                     if data_len is not None and byte_counter == data_len:
                         break
 
+                    if (pipeline and ctx.prefetch is None and ctx.range_end is not None and not ctx.scheduler.delay()
+                            and byte_counter - ctx.resume_len >= ctx.chunk_size * self._PIPELINE_THRESHOLD):
+                        prefetch_next_range()
+
+                    # Progress updates (and the rate limit and throttle checks that depend on them) are coalesced
+                    if not ctx.progress.due(byte_counter):
+                        continue
+
+                    speed = report_progress()
                     if speed and speed < (self.params.get('throttledratelimit') or 0):
                         # The speed must stay below the limit for 3 seconds
                         # This prevents raising error when the speed temporarily goes down
                         if ctx.throttle_start is None:
                             ctx.throttle_start = now
                         elif now - ctx.throttle_start > 3:
-                            if ctx.stream is not None and ctx.tmpfilename != '-':
-                                ctx.stream.close()
+                            close_stream()
                             raise ThrottledDownload
                     elif speed:
                         ctx.throttle_start = None
 
+                elif part.part_type == UMPPartType.NEXT_REQUEST_POLICY:
+                    if self._ump_debug:
+                        self.write_ump_debug(part, f'Parsed: {part.message}')
+                    ctx.scheduler.update(part.message)
+
+                elif part.part_type in (UMPPartType.PREWARM_CONNECTION, UMPPartType.HOSTNAME_CHANGE_HINT):
+                    self._handle_connection_hint(part)
+
                 elif part.part_type == UMPPartType.SABR_ERROR:
                     ctx.data.close()
-                    sabr_error = protobug.loads(part.data, SabrError)
-                    self.write_ump_debug(part, f'Parsed: {sabr_error} Data: {part.get_b64_str()}')
-                    raise RetryDownload(Exception(f'[SABRError]: YouTube returned an error for this stream: (code={sabr_error.code}, type={sabr_error.type})'))
+                    sabr_error = part.message
+                    if self._ump_debug:
+                        self.write_ump_debug(part, f'Parsed: {sabr_error} Data: {part.get_b64_str()}')
+                    raise RetryDownload(Exception(f'[SABRError]: YouTube returned an error for this stream: (type={sabr_error.type}, action={sabr_error.action})'))
 
                 # check if it is a known value in UMPPart
                 elif part.part_type != UMPPartType.UNKNOWN:
-                    self.write_ump_warning(part, f'Unhandled part. Data: {base64.b64encode(part.data)}')
+                    self.write_ump_warning(part, 'Unhandled part.')
                     continue
 
                 else:
-                    self.write_ump_warning(part, f'Unknown part. Part id: {part.part_id} Data: {base64.b64encode(part.data)}')
+                    self.write_ump_warning(part, f'Unknown part. Part id: {part.part_id}')
                     continue
 
-            ctx.data.close()
+            if ctx.progress.pending(byte_counter):
+                report_progress()
+            self._release_response(ctx.data)
+            if chunk_sizer:
+                chunk_sizer.record(byte_counter - ctx.resume_len, time.time() - ctx.request_start, ctx.ttfb)
 
             if ctx.stream is None:
                 self.to_stderr('\n')
@@ -362,13 +872,14 @@ class UMPFD(FileDownloader):
                 ctx.resume_len = byte_counter
                 raise NextFragment
 
-            if ctx.tmpfilename != '-':
-                ctx.stream.close()
+            close_stream()
 
             if data_len is not None and byte_counter != data_len:
                 err = ContentTooShortError(byte_counter, int(data_len))
                 retry(err)
 
+            if ctx.journal is not None:
+                ctx.journal.remove()
             self.try_rename(ctx.tmpfilename, ctx.filename)
 
             # Update file modification time
@@ -386,20 +897,440 @@ class UMPFD(FileDownloader):
 
             return True
 
-        for retry in RetryManager(self.params.get('retries'), self.report_retry):
-            try:
-                establish_connection()
-                return download()
-            except RetryDownload as err:
-                retry.error = err.source_error
-                continue
-            except NextFragment:
-                retry.error = None
-                retry.attempt -= 1
-                continue
-            except SucceedDownload:
+        try:
+            for retry in RetryManager(self.params.get('retries'), self.report_retry):
+                try:
+                    with self._budget.connection(ctx.url):
+                        establish_connection()
+                        return download()
+                except RetryDownload as err:
+                    discard_prefetch()
+                    if chunk_sizer:
+                        chunk_sizer.failed()
+                    retry.error = err.source_error
+                    continue
+                except NextFragment:
+                    retry.error = None
+                    retry.attempt -= 1
+                    continue
+                except SucceedDownload:
+                    return True
+                except:  # noqa: E722
+                    close_stream()
+                    raise
+            return False
+        finally:
+            discard_prefetch()
+            if ctx.prefetch_pool is not None:
+                ctx.prefetch_pool.shutdown(wait=False)
+
+    def _download_live(self, ctx, info_dict, headers):
+        """Download a live stream segment by segment, following the head of the stream until it ends"""
+        try:
+            stream, ctx.tmpfilename = self.sanitize_open(ctx.tmpfilename, 'wb')
+        except OSError as err:
+            self.report_error(f'unable to open for writing: {err}')
+            return False
+        ctx.filename = self.undo_temp_name(ctx.tmpfilename)
+        self.report_destination(ctx.filename)
+
+        ctx.request_numbers = itertools.count()
+        ctx.downloaded_bytes = 0
+        ctx.head_sequence = None
+        # Start at the live edge unless downloading from the start
+        ctx.next_sequence = 0 if self.params.get('live_from_start') else None
+        ctx.segment_duration = self._LIVE_SEGMENT_DURATION
+        ctx.has_init_segment = False
+        ctx.ended = ctx.redirected = False
+        max_lag = int_or_none(self._get_extractor_arg('ump_live_max_lag'))
+
+        def report_progress():
+            if not ctx.progress.due(ctx.downloaded_bytes):
+                return
+            now = time.time()
+            self._hook_progress({
+                'status': 'downloading',
+                'downloaded_bytes': ctx.downloaded_bytes,
+                'tmpfilename': ctx.tmpfilename,
+                'filename': ctx.filename,
+                'fragment_index': ctx.next_sequence,
+                'speed': self.calc_speed(ctx.start_time, now, ctx.downloaded_bytes),
+                'elapsed': now - ctx.start_time,
+                'ctx_id': info_dict.get('ctx_id'),
+            }, info_dict)
+
+        output = UMPOutputFile(stream, seekable=False)
+        writer = output.writer()
+        try:
+            last_segment_time = time.monotonic()
+            while not ctx.ended:
+                segments = None
+                for retry in RetryManager(self.params.get('fragment_retries'), self.report_retry):
+                    try:
+                        segments = self._fetch_live(ctx, info_dict, headers, writer)
+                    except _RetryRange as err:
+                        retry.error = err.source_error
+                if segments is None:
+                    return False
+                report_progress()
+                if ctx.redirected:
+                    ctx.redirected = False
+                    continue
+
+                now = time.monotonic()
+                if segments:
+                    last_segment_time = now
+                elif now - last_segment_time > max(self._LIVE_END_TIMEOUT, 3 * ctx.segment_duration):
+                    self.to_screen('[download] Live stream has not progressed; assuming it has ended')
+                    break
+
+                behind = ctx.head_sequence is not None and ctx.next_sequence is not None and ctx.next_sequence <= ctx.head_sequence
+                if behind and max_lag is not None and ctx.head_sequence - ctx.next_sequence > max_lag:
+                    self.report_warning(
+                        f'Fell {ctx.head_sequence - ctx.next_sequence} segments behind the live stream; '
+                        f'skipping to segment {ctx.head_sequence - max_lag}')
+                    ctx.next_sequence = ctx.head_sequence - max_lag
+                # Poll for the next segment only once it should exist, unless catching up to the head
+                delay = max(ctx.scheduler.delay(), 0 if behind and segments else ctx.segment_duration)
+                if delay and not ctx.ended:
+                    time.sleep(delay)
+        except KeyboardInterrupt:
+            # As with other live downloads, interrupting keeps what has been downloaded
+            self.to_screen('\n[download] Interrupted by user')
+        finally:
+            writer.flush()
+            output.close()
+
+        if not ctx.downloaded_bytes:
+            self.report_error('Did not get any data blocks')
+            return False
+
+        self.try_rename(ctx.tmpfilename, ctx.filename)
+        self._hook_progress({
+            'downloaded_bytes': ctx.downloaded_bytes,
+            'total_bytes': ctx.downloaded_bytes,
+            'filename': ctx.filename,
+            'status': 'finished',
+            'elapsed': time.time() - ctx.start_time,
+            'ctx_id': info_dict.get('ctx_id'),
+        }, info_dict)
+        return True
+
+    def _fetch_live(self, ctx, info_dict, headers, writer):
+        """
+        Request the next segment of a live stream (or the head, if it is not known yet).
+        Complete segments are written to writer in order. Returns the number of segments written.
+        """
+        query = {'rn': next(ctx.request_numbers), 'ump': 1, 'srfvp': 1}
+        if ctx.next_sequence is not None:
+            query['sq'] = ctx.next_sequence
+        request_url = ctx.url
+        request = Request(request_url, info_dict.get('request_data', b'x\0'), headers, query=query)
+
+        def wanted(header):
+            # Init segments usually have no sequence number, so check for them first
+            if header is not None and header.is_init_segment:
+                return not ctx.has_init_segment
+            if header is None or header.sequence_number is None:
                 return True
-            except:  # noqa: E722
-                close_stream()
+            return ctx.next_sequence is None or header.sequence_number >= ctx.next_sequence
+
+        with self._budget.connection(request_url):
+            try:
+                response = self.ydl.urlopen(request)
+            except HTTPError as err:
+                if 500 <= err.status < 600:
+                    raise _RetryRange(err)
+                if self._drop_cached_redirect(ctx, info_dict['url'], request_url):
+                    # Request the segment again from the original URL without using up an attempt
+                    ctx.redirected = True
+                    return 0
+                raise
+            except CertificateVerifyError:
+                raise
+            except TransportError as err:
+                raise _RetryRange(err)
+
+            demuxer = _MediaDemuxer(self._format_itag(info_dict))
+            # Segments are only written once complete, so that a retried request cannot duplicate part of one
+            buffers = {}
+            segments = 0
+            try:
+                for part in UMPParser(response, stream_part_types=(UMPPartType.MEDIA,)).iter_parts():
+                    if part.part_type == UMPPartType.LIVE_METADATA:
+                        metadata = part.message
+                        if self._ump_debug:
+                            self.write_ump_debug(part, f'Parsed: {metadata}')
+                        if metadata.head_sequence_number is not None:
+                            ctx.head_sequence = metadata.head_sequence_number
+                            if ctx.next_sequence is None:
+                                ctx.next_sequence = ctx.head_sequence
+
+                    elif part.part_type == UMPPartType.MEDIA:
+                        if part.size <= 1:
+                            continue
+                        data_block = demuxer.media_data(part)
+                        if data_block is not None and wanted(demuxer.header):
+                            buffers.setdefault(demuxer.header_id, bytearray()).extend(data_block)
+
+                    elif part.part_type == UMPPartType.MEDIA_END:
+                        header_id = part.data[0]
+                        if self._ump_debug:
+                            self.write_ump_debug(part, f' Header ID: {header_id}')
+                        data = buffers.pop(header_id, None)
+                        header = demuxer.headers.get(header_id)
+                        if data is None or not wanted(header):
+                            continue
+                        writer.write(data)
+                        ctx.downloaded_bytes += len(data)
+                        self._budget.throttle(len(data))
+                        if header is not None and header.is_init_segment:
+                            ctx.has_init_segment = True
+                            continue
+                        segments += 1
+                        if header is not None and header.sequence_number is not None:
+                            ctx.next_sequence = header.sequence_number + 1
+                        if header is not None and header.duration_ms:
+                            ctx.segment_duration = header.duration_ms / 1000
+
+                    elif part.part_type == UMPPartType.END_OF_TRACK:
+                        if self._ump_debug:
+                            self.write_ump_debug(part, f'Data: {part.get_b64_str()}')
+                        ctx.ended = True
+
+                    else:
+                        _, done = self._handle_range_part(ctx, part, 0, 0, writer, None, demuxer)
+                        if done:
+                            # Redirected; the segment is requested again from the new URL
+                            ctx.redirected = True
+                            break
+            except TransportError as err:
+                response.close()
+                raise _RetryRange(err)
+            except BaseException:
+                response.close()
+                raise
+            self._release_response(response)
+        return segments
+
+    def _download_ranges(self, ctx, info_dict, headers, chunk_size, concurrency):
+        """Download the format as separate ranges over concurrent connections, writing each at its offset"""
+        total = ctx.content_len
+        journal = ctx.journal
+        # Only the ranges that are not on disk yet are downloaded
+        missing = journal.missing()
+        range_size = chunk_size or -(-sum(end - start for start, end in missing) // concurrency)
+        ranges = [
+            (start, min(start + range_size, missing_end) - 1)
+            for missing_start, missing_end in missing for start in range(missing_start, missing_end, range_size)]
+
+        ctx.resume_len = journal.downloaded_bytes
+        try:
+            stream, ctx.tmpfilename = self._open_output(ctx.tmpfilename, 'r+b' if ctx.resume_len else 'wb')
+            ctx.output = UMPOutputFile(stream, journal=journal)
+            ctx.output.preallocate(total)
+        except OSError as err:
+            self.report_error(f'unable to open for writing: {err}')
+            return False
+        ctx.filename = self.undo_temp_name(ctx.tmpfilename)
+        self.report_destination(ctx.filename)
+        if ctx.resume_len:
+            self.report_resuming_byte(ctx.resume_len)
+
+        ctx.request_numbers = itertools.count(journal.request_number + 1)
+        ctx.cancelled = threading.Event()
+        ctx.downloaded_bytes = ctx.resume_len
+        progress_lock = threading.Lock()
+
+        def report_progress(byte_count):
+            with progress_lock:
+                ctx.downloaded_bytes += byte_count
+                if not ctx.progress.due(ctx.downloaded_bytes):
+                    return
+                now = time.time()
+                self._hook_progress({
+                    'status': 'downloading',
+                    'downloaded_bytes': ctx.downloaded_bytes,
+                    'total_bytes': total,
+                    'tmpfilename': ctx.tmpfilename,
+                    'filename': ctx.filename,
+                    'eta': self.calc_eta(ctx.start_time, now, total - ctx.resume_len, ctx.downloaded_bytes - ctx.resume_len),
+                    'speed': self.calc_speed(ctx.start_time, now, ctx.downloaded_bytes - ctx.resume_len),
+                    'elapsed': now - ctx.start_time,
+                    'ctx_id': info_dict.get('ctx_id'),
+                }, info_dict)
+            self.slow_down(ctx.start_time, now, ctx.downloaded_bytes - ctx.resume_len)
+
+        success = False
+        try:
+            with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+                futures = [
+                    pool.submit(self._download_range, ctx, info_dict, headers, index, range_start, range_end, report_progress)
+                    for index, (range_start, range_end) in enumerate(ranges)]
+                try:
+                    success = all(future.result() for future in futures)
+                finally:
+                    ctx.cancelled.set()
+                    for future in futures:
+                        future.cancel()
+        finally:
+            # The journal is saved on close, so an unsuccessful download can be resumed
+            ctx.output.close()
+        if not success:
+            return False
+
+        journal.remove()
+        self.try_rename(ctx.tmpfilename, ctx.filename)
+        self._hook_progress({
+            'downloaded_bytes': total,
+            'total_bytes': total,
+            'filename': ctx.filename,
+            'status': 'finished',
+            'elapsed': time.time() - ctx.start_time,
+            'ctx_id': info_dict.get('ctx_id'),
+        }, info_dict)
+        return True
+
+    def _download_range(self, ctx, info_dict, headers, index, range_start, range_end, report_progress):
+        """Download one range into the temp file, retrying from where it left off"""
+        pos = range_start
+        writer = ctx.output.writer(range_start)
+        try:
+            for retry in RetryManager(self.params.get('fragment_retries'), self.report_retry, frag_index=index + 1):
+                try:
+                    while pos <= range_end and not ctx.cancelled.is_set():
+                        pos = self._fetch_range(ctx, info_dict, headers, pos, range_end, writer, report_progress)
+                except _RetryRange as err:
+                    retry.error = err.source_error
+            writer.flush()
+        except OSError as err:
+            raise DownloadError(f'unable to write data: {err}')
+        return pos > range_end
+
+    def _fetch_range(self, ctx, info_dict, headers, pos, range_end, stream, report_progress):
+        """Make a single request for pos-range_end, writing media to stream. Returns the new position"""
+        # Backoff requested by the server applies to all connections
+        if ctx.cancelled.wait(ctx.scheduler.delay()):
+            return pos
+        request_number = next(ctx.request_numbers)
+        if ctx.journal is not None:
+            ctx.journal.request_number = max(ctx.journal.request_number, request_number)
+        request_url = ctx.url
+        request = Request(
+            request_url, info_dict.get('request_data', b'x\0'), headers,
+            query={'range': f'{pos}-{range_end}', 'rn': request_number, 'ump': 1, 'srfvp': 1})
+        start_pos = pos
+        redirected = False
+        demuxer = _MediaDemuxer(self._format_itag(info_dict))
+        with contextlib.nullcontext() if ctx.ignore_host_connections else self._budget.connection(request_url):
+            try:
+                response = self.ydl.urlopen(request)
+            except HTTPError as err:
+                if 500 <= err.status < 600:
+                    raise _RetryRange(err)
+                if self._drop_cached_redirect(ctx, info_dict['url'], request_url):
+                    # Request the range again from the original URL without using up an attempt
+                    return pos
+                raise
+            except CertificateVerifyError:
                 raise
-        return False
\ No newline at end of file
+            except TransportError as err:
+                raise _RetryRange(err)
+
+            try:
+                for part in UMPParser(response, stream_part_types=(UMPPartType.MEDIA,)).iter_parts():
+                    if ctx.cancelled.is_set():
+                        break
+                    part_start = pos
+                    pos, done = self._handle_range_part(ctx, part, pos, range_end, stream, report_progress, demuxer)
+                    self._budget.throttle(pos - part_start)
+                    if done:
+                        redirected = part.part_type == UMPPartType.SABR_REDIRECT
+                        break
+            except TransportError as err:
+                response.close()
+                raise _RetryRange(err)
+            except BaseException:
+                response.close()
+                raise
+            if ctx.cancelled.is_set():
+                response.close()
+            else:
+                self._release_response(response)
+
+        if pos == start_pos and not redirected and not ctx.cancelled.is_set():
+            raise _RetryRange(Exception('Did not get any data blocks'))
+        return pos
+
+    def _handle_range_part(self, ctx, part, pos, range_end, stream, report_progress, demuxer):
+        """
+        Handle a part of a range response, writing any media to stream.
+        Returns the new position and whether the rest of the response should be skipped.
+        """
+        if part.part_type == UMPPartType.MEDIA:
+            if part.size <= 1:
+                return pos, True
+            if part.is_first and self._ump_debug:
+                self.write_ump_debug(part, f'Header ID: {part.data[0]}')
+            data_block = demuxer.media_data(part)
+            if data_block is None:
+                return pos, False
+            data_block = data_block[:range_end + 1 - pos]
+            if data_block:
+                try:
+                    stream.write(data_block)
+                except OSError as err:
+                    raise DownloadError(f'unable to write data: {err}')
+                pos += len(data_block)
+                report_progress(len(data_block))
+            return pos, pos > range_end
+
+        elif part.part_type == UMPPartType.MEDIA_HEADER:
+            if self._ump_debug:
+                self.write_ump_debug(part, f'Parsed header: {part.message} Data: {part.get_b64_str()}')
+            demuxer.add_header(part.message)
+
+        elif part.part_type == UMPPartType.MEDIA_END:
+            if self._ump_debug:
+                self.write_ump_debug(part, f' Header ID: {part.data[0]}')
+            # The end of media of another format does not end this response
+            return pos, demuxer.accepts(part.data[0])
+
+        elif part.part_type == UMPPartType.STREAM_PROTECTION_STATUS:
+            sps = part.message
+            if self._ump_debug:
+                self.write_ump_debug(part, f'Status: {StreamProtectionStatus.Status(sps.status).name} Data: {part.get_b64_str()}')
+            if sps.status == StreamProtectionStatus.Status.ATTESTATION_REQUIRED:
+                raise DownloadError('StreamProtectionStatus: Attestation Required (missing PO Token?)')
+
+        elif part.part_type == UMPPartType.SABR_REDIRECT:
+            redirect_url = part.message.redirect_url
+            if self._ump_debug:
+                self.write_ump_debug(part, f'New URL: {redirect_url}')
+            if not redirect_url:
+                raise DownloadError('SABRRedirect: Invalid redirect URL')
+            self._follow_redirect(ctx, redirect_url)
+            # The remainder of the range is requested again from the new URL
+            return pos, True
+
+        elif part.part_type == UMPPartType.NEXT_REQUEST_POLICY:
+            if self._ump_debug:
+                self.write_ump_debug(part, f'Parsed: {part.message}')
+            ctx.scheduler.update(part.message)
+
+        elif part.part_type in (UMPPartType.PREWARM_CONNECTION, UMPPartType.HOSTNAME_CHANGE_HINT):
+            self._handle_connection_hint(part)
+
+        elif part.part_type == UMPPartType.SABR_ERROR:
+            sabr_error = part.message
+            if self._ump_debug:
+                self.write_ump_debug(part, f'Parsed: {sabr_error} Data: {part.get_b64_str()}')
+            raise _RetryRange(Exception(f'[SABRError]: YouTube returned an error for this stream: (type={sabr_error.type}, action={sabr_error.action})'))
+
+        elif part.part_type != UMPPartType.UNKNOWN:
+            self.write_ump_warning(part, 'Unhandled part.')
+
+        else:
+            self.write_ump_warning(part, f'Unknown part. Part id: {part.part_id}')
+
+        return pos, False
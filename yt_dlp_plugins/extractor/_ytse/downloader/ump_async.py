@@ -0,0 +1,285 @@
+import asyncio
+import itertools
+import time
+import urllib.parse
+
+from yt_dlp import DownloadError
+from yt_dlp.networking._helper import make_ssl_context
+from yt_dlp.utils import traverse_obj, update_url_query
+from yt_dlp.utils.networking import HTTPHeaderDict
+
+from yt_dlp_plugins.extractor._ytse.downloader.ump import UMPFD, _MediaDemuxer, _RequestScheduler, _RetryRange
+from yt_dlp_plugins.extractor._ytse.downloader.ump_output import UMPOutputFile
+from yt_dlp_plugins.extractor._ytse.ump import UMPDecoder, UMPPartType
+
+
+class _AsyncResponse:
+    """A minimal streaming HTTP/1.1 response read from asyncio streams"""
+
+    READ_SIZE = 256 * 1024
+
+    def __init__(self, reader, writer, status, headers, timeout):
+        self.reader = reader
+        self.writer = writer
+        self.status = status
+        self.headers = headers
+        self.timeout = timeout
+
+    async def _read(self, coro):
+        return await asyncio.wait_for(coro, self.timeout)
+
+    async def iter_content(self):
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            while True:
+                size = int((await self._read(self.reader.readline())).split(b';')[0], 16)
+                if not size:
+                    break
+                while size:
+                    data = await self._read(self.reader.read(min(size, self.READ_SIZE)))
+                    if not data:
+                        raise asyncio.IncompleteReadError(b'', size)
+                    size -= len(data)
+                    yield data
+                await self._read(self.reader.readline())
+            return
+
+        remaining = self.headers.get('Content-Length')
+        remaining = int(remaining) if remaining is not None else None
+        while remaining is None or remaining > 0:
+            data = await self._read(self.reader.read(self.READ_SIZE if remaining is None else min(remaining, self.READ_SIZE)))
+            if not data:
+                if remaining:
+                    raise asyncio.IncompleteReadError(b'', remaining)
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            yield data
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncUMPDownloader:
+    """
+    asyncio implementation of the UMPFD download loop.
+
+    Many UMP downloads can be multiplexed in a single event loop with download_many().
+    Part handling (redirects, SABR errors, stream protection status and progress hooks)
+    is shared with UMPFD, which is used for all reporting.
+
+    Requests are made with a minimal HTTP/1.1 client on asyncio streams rather than
+    through yt-dlp's request handlers, so impersonation is not supported, and proxies,
+    source addresses and client certificates raise a DownloadError.
+    """
+
+    MAX_REDIRECTS = 10
+
+    def __init__(self, fd: UMPFD, max_connections: int = 100):
+        self.fd = fd
+        self.params = fd.params
+        self.timeout = self.params.get('socket_timeout') or 20
+        self.max_connections = max_connections
+        unsupported = [name for name in ('proxy', 'source_address', 'client_certificate') if self.params.get(name)]
+        if unsupported:
+            raise DownloadError(f'The asyncio UMP downloader does not support {", ".join(unsupported)}')
+        # Created in the loop it is used in; before Python 3.10 a semaphore is bound to the loop current at creation
+        self._connections = None
+        self._connections_loop = None
+        self._ssl_context = make_ssl_context(
+            verify=not self.params.get('nocheckcertificate'),
+            use_certifi='no-certifi' not in (self.params.get('compat_opts') or ()))
+
+    def _connection_slots(self):
+        loop = asyncio.get_running_loop()
+        if self._connections_loop is not loop:
+            self._connections = asyncio.Semaphore(self.max_connections)
+            self._connections_loop = loop
+        return self._connections
+
+    async def _request(self, url, data, headers):
+        for _ in range(self.MAX_REDIRECTS):
+            parsed = urllib.parse.urlparse(url)
+            is_https = parsed.scheme == 'https'
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(
+                parsed.hostname, parsed.port or (443 if is_https else 80),
+                ssl=self._ssl_context if is_https else None), self.timeout)
+
+            try:
+                request_headers = HTTPHeaderDict(headers, {'Host': parsed.netloc, 'Connection': 'close'})
+                cookie_header = self.fd.ydl.cookiejar.get_cookie_header(url)
+                if cookie_header:
+                    request_headers['Cookie'] = cookie_header
+                if data is not None:
+                    request_headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+                    request_headers['Content-Length'] = str(len(data))
+                target = parsed.path or '/'
+                if parsed.query:
+                    target += f'?{parsed.query}'
+                writer.write(f'{"GET" if data is None else "POST"} {target} HTTP/1.1\r\n'.encode())
+                writer.write(''.join(f'{name}: {value}\r\n' for name, value in request_headers.items()).encode())
+                writer.write(b'\r\n' + (data or b''))
+                await writer.drain()
+
+                status_line = await asyncio.wait_for(reader.readline(), self.timeout)
+                status = int(status_line.split()[1])
+                response_headers = HTTPHeaderDict()
+                while (line := await asyncio.wait_for(reader.readline(), self.timeout)) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    response_headers[name.strip()] = value.strip()
+
+                response = _AsyncResponse(reader, writer, status, response_headers, self.timeout)
+            except BaseException:
+                writer.close()
+                raise
+            if status in (301, 302, 303, 307, 308) and response_headers.get('Location'):
+                response.close()
+                url = urllib.parse.urljoin(url, response_headers['Location'])
+                if status == 303 or (status in (301, 302) and data is not None):
+                    data = None
+                continue
+            return response
+
+        raise DownloadError(f'Too many redirects for {url}')
+
+    async def _fetch_range(self, ctx, info_dict, headers, pos, range_end, stream, report_progress):
+        """Make a single request for pos-range_end, writing media to stream. Returns the new position"""
+        await asyncio.sleep(ctx.scheduler.delay())
+        request_url = ctx.url
+        url = update_url_query(request_url, {'range': f'{pos}-{range_end}', 'rn': next(ctx.request_numbers), 'ump': 1, 'srfvp': 1})
+        start_pos, redirected = pos, False
+        async with self._connection_slots():
+            try:
+                response = await self._request(url, info_dict.get('request_data', b'x\0'), headers)
+            except (OSError, asyncio.TimeoutError, ValueError, IndexError) as err:
+                raise _RetryRange(err)
+
+            try:
+                if 500 <= response.status < 600:
+                    raise _RetryRange(Exception(f'HTTP Error {response.status}'))
+                elif response.status >= 400:
+                    if self.fd._drop_cached_redirect(ctx, info_dict['url'], request_url):
+                        # Request the range again from the original URL without using up an attempt
+                        return pos
+                    raise DownloadError(f'Unable to download: HTTP Error {response.status}')
+
+                decoder = UMPDecoder(stream_part_types=(UMPPartType.MEDIA,))
+                demuxer = _MediaDemuxer(self.fd._format_itag(info_dict))
+                done = False
+                async for data in response.iter_content():
+                    delay = self.fd._budget.reserve(len(data))
+                    if delay:
+                        await asyncio.sleep(delay)
+                    for part in decoder.feed(data):
+                        pos, done = self.fd._handle_range_part(ctx, part, pos, range_end, stream, report_progress, demuxer)
+                        if done:
+                            redirected = part.part_type == UMPPartType.SABR_REDIRECT
+                            break
+                    if done:
+                        break
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as err:
+                raise _RetryRange(err)
+            finally:
+                response.close()
+
+        if pos == start_pos and not redirected:
+            raise _RetryRange(Exception('Did not get any data blocks'))
+        return pos
+
+    async def download(self, filename, info_dict) -> bool:
+        fd = self.fd
+        ctx = type('DownloadContext', (), {})()
+        ctx.journal = None
+        fd._init_url(ctx, info_dict['url'])
+        ctx.filename = filename
+        ctx.tmpfilename = fd.temp_name(filename)
+        ctx.request_numbers = itertools.count()
+        ctx.start_time = time.time()
+        ctx.downloaded_bytes = 0
+        ctx.scheduler = _RequestScheduler(info_dict)
+        ctx.progress = fd._progress_coalescer()
+
+        total = info_dict.get('filesize')
+        if not total:
+            raise DownloadError('Missing filesize')
+
+        headers = HTTPHeaderDict({'Accept-Encoding': 'identity', 'Accept': '*/*'}, info_dict.get('http_headers'))
+        chunk_size = (
+            self.params.get('http_chunk_size')
+            or info_dict.get('downloader_options', {}).get('http_chunk_size')
+            or total)
+        retries = self.params.get('retries') or 0
+        retry_sleep = traverse_obj(self.params, ('retry_sleep_functions', 'http'))
+
+        def report_progress(byte_count):
+            ctx.downloaded_bytes += byte_count
+            if not ctx.progress.due(ctx.downloaded_bytes):
+                return
+            now = time.time()
+            fd._hook_progress({
+                'status': 'downloading',
+                'downloaded_bytes': ctx.downloaded_bytes,
+                'total_bytes': total,
+                'tmpfilename': ctx.tmpfilename,
+                'filename': ctx.filename,
+                'eta': fd.calc_eta(ctx.start_time, now, total, ctx.downloaded_bytes),
+                'speed': fd.calc_speed(ctx.start_time, now, ctx.downloaded_bytes),
+                'elapsed': now - ctx.start_time,
+                'ctx_id': info_dict.get('ctx_id'),
+            }, info_dict)
+
+        try:
+            stream, ctx.tmpfilename = fd.sanitize_open(ctx.tmpfilename, 'wb')
+            output = UMPOutputFile(stream)
+            output.preallocate(total)
+        except OSError as err:
+            fd.report_error(f'unable to open for writing: {err}')
+            return False
+        ctx.filename = fd.undo_temp_name(ctx.tmpfilename)
+        fd.report_destination(ctx.filename)
+
+        # Media is written with blocking writes; they are coalesced into large sequential writes per download
+        writer = output.writer()
+        try:
+            pos = 0
+            attempt = 0
+            while pos < total:
+                try:
+                    pos = await self._fetch_range(ctx, info_dict, headers, pos, min(pos + chunk_size, total) - 1, writer, report_progress)
+                    attempt = 0
+                except _RetryRange as err:
+                    attempt += 1
+                    if attempt > retries:
+                        fd.report_error(f'Got error: {err.source_error}. Giving up after {retries} retries')
+                        return False
+                    fd.report_warning(f'Got error: {err.source_error}. Retrying ({attempt}/{retries})...')
+                    # Sleep here rather than in report_retry so that the event loop is not blocked
+                    if retry_sleep:
+                        await asyncio.sleep(retry_sleep(n=attempt - 1))
+            writer.flush()
+        except OSError as err:
+            fd.report_error(f'unable to write data: {err}')
+            return False
+        finally:
+            output.close()
+
+        fd.try_rename(ctx.tmpfilename, ctx.filename)
+        fd._hook_progress({
+            'downloaded_bytes': total,
+            'total_bytes': total,
+            'filename': ctx.filename,
+            'status': 'finished',
+            'elapsed': time.time() - ctx.start_time,
+            'ctx_id': info_dict.get('ctx_id'),
+        }, info_dict)
+        return True
+
+    async def download_many(self, downloads) -> list:
+        """
+        Download many (filename, info_dict) pairs concurrently.
+        Returns a list with True/False (or the raised exception) for each download.
+        """
+        return await asyncio.gather(
+            *(self.download(filename, info_dict) for filename, info_dict in downloads), return_exceptions=True)
+
+
+__all__ = ['AsyncUMPDownloader']
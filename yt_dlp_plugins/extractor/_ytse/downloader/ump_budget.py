@@ -0,0 +1,73 @@
+import collections
+import contextlib
+import threading
+import time
+import urllib.parse
+
+
+class UMPDownloadBudget:
+    """
+    Process-wide bandwidth and connection budget shared by all UMP downloads.
+
+    Bandwidth is handed out as reservations in the order they are made, so concurrent downloads
+    get an equal share of the rate instead of the fastest connection taking most of it.
+    Reservations return the time to wait rather than sleeping, so they can be used from asyncio too.
+    Connections per host are limited with a semaphore per host.
+    """
+
+    # Seconds of bandwidth that may be used in a burst after being idle
+    BURST_SECONDS = 0.5
+
+    def __init__(self, rate=None, host_connections=None):
+        self._lock = threading.Lock()
+        self._next_time = 0
+        self._host_slots = collections.defaultdict(lambda: threading.BoundedSemaphore(self.host_connections))
+        self.rate = None
+        self.host_connections = None
+        self.configure(rate, host_connections)
+
+    def configure(self, rate=None, host_connections=None):
+        """
+        Set the global rate (bytes per second) and/or connections per host.
+        A value of None leaves that limit unchanged, and 0 removes it.
+        """
+        with self._lock:
+            if rate is not None:
+                self.rate = rate or None
+            if host_connections is not None and (host_connections or None) != self.host_connections:
+                self.host_connections = host_connections or None
+                # Downloads holding a slot release it to the semaphore they took it from
+                self._host_slots.clear()
+
+    def reserve(self, byte_count) -> float:
+        """Reserve bandwidth for byte_count bytes. Returns the seconds to wait before they are within the budget"""
+        if not self.rate or byte_count <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next_time, now)
+            self._next_time = start + byte_count / self.rate
+            return max(self._next_time - now - self.BURST_SECONDS, 0)
+
+    def throttle(self, byte_count):
+        delay = self.reserve(byte_count)
+        if delay:
+            time.sleep(delay)
+
+    @contextlib.contextmanager
+    def connection(self, url):
+        """Hold one of the connections to the host of url"""
+        if not self.host_connections:
+            yield
+            return
+        host = urllib.parse.urlparse(url).netloc
+        with self._lock:
+            slot = self._host_slots[host]
+        with slot:
+            yield
+
+
+download_budget = UMPDownloadBudget()
+
+
+__all__ = ['UMPDownloadBudget', 'download_budget']
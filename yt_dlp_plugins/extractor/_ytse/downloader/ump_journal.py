@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import time
+
+
+class UMPJournal:
+    """
+    A sidecar file recording which byte ranges of a UMP download are on disk.
+
+    Ranges are only recorded once they have been written to the output file, and the output file is synced
+    before the journal is saved, so an interrupted download can be resumed from the journal alone.
+    The last redirect URL and request number are saved too, so that a resumed download continues the same session.
+    """
+
+    # Minimum time between saves of the journal while downloading
+    SAVE_INTERVAL = 1
+
+    def __init__(self, filename):
+        self.filename = filename + '.ytdl'
+        self.filesize = None
+        self.url = None
+        self.request_number = -1
+        # Sorted, non-overlapping and non-adjacent [start, end) ranges
+        self.ranges = []
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._saved_time = 0
+
+    def load(self, filesize, tmpfilename) -> bool:
+        """Load the journal for a download of filesize bytes into tmpfilename. Returns whether there is anything to resume"""
+        try:
+            with open(self.filename, encoding='utf-8') as f:
+                state = json.load(f)['ump']
+            disk_size = os.path.getsize(tmpfilename)
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        if state.get('filesize') != filesize:
+            return False
+        self.filesize = filesize
+        self.url = state.get('url')
+        self.request_number = state.get('request_number', -1)
+        self.ranges = []
+        for start, end in state.get('ranges') or []:
+            # Anything past the end of the file was never written
+            end = min(end, disk_size)
+            if start < end:
+                self.add(start, end)
+        return bool(self.ranges)
+
+    def reset(self, filesize):
+        self.filesize = filesize
+        self.url = None
+        self.request_number = -1
+        self.ranges = []
+
+    def add(self, start, end):
+        """Record that bytes start to end (exclusive) are on disk"""
+        with self._lock:
+            merged = []
+            for range_start, range_end in self.ranges:
+                if range_end < start or range_start > end:
+                    merged.append((range_start, range_end))
+                else:
+                    start, end = min(start, range_start), max(end, range_end)
+            merged.append((start, end))
+            merged.sort()
+            self.ranges = merged
+
+    @property
+    def downloaded_bytes(self):
+        return sum(end - start for start, end in self.ranges)
+
+    @property
+    def contiguous_end(self):
+        """End of the data downloaded from the start of the file"""
+        return self.ranges[0][1] if self.ranges and self.ranges[0][0] == 0 else 0
+
+    def missing(self):
+        """The (start, end) ranges (exclusive end) that have not been downloaded"""
+        gaps = []
+        pos = 0
+        for start, end in self.ranges:
+            if start > pos:
+                gaps.append((pos, start))
+            pos = end
+        if pos < self.filesize:
+            gaps.append((pos, self.filesize))
+        return gaps
+
+    def save_due(self) -> bool:
+        return time.monotonic() - self._saved_time >= self.SAVE_INTERVAL
+
+    def snapshot(self):
+        """The current state of the journal, to be saved with save()"""
+        with self._lock:
+            self._saved_time = time.monotonic()
+            return {
+                'filesize': self.filesize,
+                'url': self.url,
+                'request_number': self.request_number,
+                'ranges': self.ranges,
+            }
+
+    def save(self, state=None):
+        """Save a snapshot of the journal (the current state if not given)"""
+        if state is None:
+            state = self.snapshot()
+        with self._save_lock:
+            # Replace the journal atomically, so an interruption cannot leave it half written
+            tmp_filename = self.filename + '.part'
+            with open(tmp_filename, 'w', encoding='utf-8') as f:
+                json.dump({'ump': state}, f)
+            os.replace(tmp_filename, self.filename)
+
+    def remove(self):
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+
+
+__all__ = ['UMPJournal']
@@ -0,0 +1,176 @@
+import itertools
+import os
+import subprocess
+import threading
+import time
+
+from yt_dlp import DownloadError
+from yt_dlp.postprocessor.ffmpeg import EXT_TO_OUT_FORMATS, FFmpegPostProcessor
+from yt_dlp.utils import Popen, RetryManager
+
+from yt_dlp_plugins.extractor._ytse.downloader.ump import UMPFD, _RequestScheduler, _RetryRange
+from yt_dlp_plugins.extractor._ytse.downloader.ump_output import UMPOutputFile
+
+
+class UMPMuxer:
+    """
+    Downloads the requested formats of a merged format and muxes them with ffmpeg while the data arrives.
+
+    Each format is downloaded sequentially in its own thread and written to an ffmpeg input pipe,
+    so no intermediate files are written. Writes block while ffmpeg is not reading a format,
+    which keeps a fast format from running ahead of the muxer.
+    Part handling and reporting are shared with UMPFD. Only available on POSIX systems.
+    """
+
+    def __init__(self, fd: UMPFD):
+        self.fd = fd
+        self.params = fd.params
+        self._ffmpeg = FFmpegPostProcessor(fd.ydl)
+
+    @property
+    def available(self):
+        return self._ffmpeg.available and os.name != 'nt'
+
+    def _download_format(self, ctx, info_dict, stream, report_progress):
+        """Download a format from start to end into stream"""
+        fmt = type('DownloadContext', (), {})()
+        fmt.request_numbers = itertools.count()
+        fmt.scheduler = _RequestScheduler(info_dict)
+        fmt.cancelled = ctx.cancelled
+        fmt.journal = None
+        # Waiting for a connection while another format is blocked on ffmpeg reading this one would deadlock
+        fmt.ignore_host_connections = True
+        self.fd._init_url(fmt, info_dict['url'])
+
+        total = info_dict.get('filesize')
+        if not total:
+            raise DownloadError('Missing filesize')
+        headers = self.fd._request_headers(info_dict)
+        chunk_size = (
+            self.params.get('http_chunk_size')
+            or info_dict.get('downloader_options', {}).get('http_chunk_size')
+            or total)
+
+        pos = 0
+        writer = UMPOutputFile(stream, seekable=False).writer()
+        for retry in RetryManager(self.params.get('retries'), self.fd.report_retry):
+            try:
+                while pos < total and not ctx.cancelled.is_set():
+                    pos = self.fd._fetch_range(
+                        fmt, info_dict, headers, pos, min(pos + chunk_size, total) - 1, writer, report_progress)
+            except _RetryRange as err:
+                retry.error = err.source_error
+        writer.flush()
+        return pos >= total
+
+    def download(self, filename, info_dict) -> bool:
+        """Download info_dict['requested_formats'] and mux them into filename"""
+        fd = self.fd
+        formats = info_dict['requested_formats']
+        if not self.available:
+            fd.report_error('ffmpeg and a POSIX system are required to mux UMP formats while downloading')
+            return False
+
+        ctx = type('DownloadContext', (), {})()
+        ctx.filename = filename
+        ctx.tmpfilename = fd.temp_name(filename)
+        ctx.cancelled = threading.Event()
+        ctx.start_time = time.time()
+        ctx.downloaded_bytes = 0
+        ctx.progress = fd._progress_coalescer()
+        total = sum(f.get('filesize') or 0 for f in formats)
+        progress_lock = threading.Lock()
+
+        def report_progress(byte_count):
+            with progress_lock:
+                ctx.downloaded_bytes += byte_count
+                if not ctx.progress.due(ctx.downloaded_bytes):
+                    return
+                now = time.time()
+                fd._hook_progress({
+                    'status': 'downloading',
+                    'downloaded_bytes': ctx.downloaded_bytes,
+                    'total_bytes': total,
+                    'tmpfilename': ctx.tmpfilename,
+                    'filename': ctx.filename,
+                    'eta': fd.calc_eta(ctx.start_time, now, total, ctx.downloaded_bytes),
+                    'speed': fd.calc_speed(ctx.start_time, now, ctx.downloaded_bytes),
+                    'elapsed': now - ctx.start_time,
+                    'ctx_id': info_dict.get('ctx_id'),
+                }, info_dict)
+            fd.slow_down(ctx.start_time, now, ctx.downloaded_bytes)
+
+        pipes = [os.pipe() for _ in formats]
+        args = [self._ffmpeg.executable, '-y', '-loglevel', 'error', '-nostdin']
+        for read_fd, _ in pipes:
+            args += ['-i', f'pipe:{read_fd}']
+        for index in range(len(formats)):
+            args += ['-map', str(index)]
+        ext = info_dict.get('ext')
+        args += ['-c', 'copy', '-f', EXT_TO_OUT_FORMATS.get(ext, ext), ctx.tmpfilename]
+
+        fd.report_destination(ctx.filename)
+        fd.write_debug(f'ffmpeg command line: {" ".join(args)}')
+        try:
+            proc = Popen(
+                args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                pass_fds=[read_fd for read_fd, _ in pipes])
+        except OSError as err:
+            for read_fd, write_fd in pipes:
+                os.close(read_fd)
+                os.close(write_fd)
+            fd.report_error(f'unable to start ffmpeg: {err}')
+            return False
+        for read_fd, _ in pipes:
+            os.close(read_fd)
+
+        results = [False] * len(formats)
+        errors = []
+
+        def download_format(index, format_info):
+            format_info = {**info_dict, **format_info}
+            format_info.pop('requested_formats', None)
+            try:
+                with open(pipes[index][1], 'wb', buffering=0) as stream:
+                    results[index] = self._download_format(ctx, format_info, stream, report_progress)
+            except Exception as err:
+                errors.append(err)
+            if not results[index]:
+                # Unblock the other formats, which may be waiting for ffmpeg
+                ctx.cancelled.set()
+                proc.kill()
+
+        threads = [
+            threading.Thread(target=download_format, args=(index, f), daemon=True)
+            for index, f in enumerate(formats)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            ctx.cancelled.set()
+            _, stderr = proc.communicate_or_kill()
+
+        if not all(results) or proc.returncode:
+            fd.try_remove(ctx.tmpfilename)
+            # A broken pipe is only a symptom of ffmpeg exiting
+            errors = [err for err in errors if not isinstance(err, BrokenPipeError)]
+            if errors:
+                raise errors[0]
+            fd.report_error(f'ffmpeg exited with code {proc.returncode}: {stderr.decode(errors="replace").strip()}')
+            return False
+
+        fd.try_rename(ctx.tmpfilename, ctx.filename)
+        fd._hook_progress({
+            'downloaded_bytes': ctx.downloaded_bytes,
+            'total_bytes': ctx.downloaded_bytes,
+            'filename': ctx.filename,
+            'status': 'finished',
+            'elapsed': time.time() - ctx.start_time,
+            'ctx_id': info_dict.get('ctx_id'),
+        }, info_dict)
+        return True
+
+
+__all__ = ['UMPMuxer']
@@ -0,0 +1,123 @@
+import os
+import threading
+
+
+class UMPOutputFile:
+    """
+    The output file of a UMP download.
+
+    The file is kept open for the whole download and can be preallocated to the known size.
+    Media is written at explicit offsets, so several ranges can be written concurrently.
+    Non-seekable outputs (e.g. stdout) are written sequentially.
+    If a journal is given, written ranges are recorded in it and it is saved periodically.
+    """
+
+    def __init__(self, stream, seekable=True, journal=None):
+        self.stream = stream
+        self.journal = journal
+        self._lock = threading.Lock()
+        try:
+            self.seekable = seekable and stream.seekable()
+            self._fileno = stream.fileno() if self.seekable else None
+        except (OSError, ValueError):
+            self.seekable, self._fileno = False, None
+        if self._fileno is not None:
+            # Buffered data in the file object would be written at the wrong position
+            stream.flush()
+
+    def preallocate(self, size):
+        """Allocate size bytes on disk for the file, so the media is not fragmented as it is written"""
+        if not self.seekable:
+            return
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self._fileno, 0, size)
+                return
+            except OSError:
+                # Not supported by every filesystem
+                pass
+        if os.fstat(self._fileno).st_size < size:
+            os.ftruncate(self._fileno, size)
+
+    def write_at(self, offset, data):
+        if not self.seekable:
+            self.stream.write(data)
+            return
+
+        size = len(data)
+        self._write_at(offset, data)
+        if self.journal is not None:
+            self.journal.add(offset, offset + size)
+            if self.journal.save_due():
+                self.save_journal()
+
+    def _write_at(self, offset, data):
+        with memoryview(data) as view:
+            if hasattr(os, 'pwrite'):
+                while view:
+                    written = os.pwrite(self._fileno, view, offset)
+                    view, offset = view[written:], offset + written
+                return
+            with self._lock:
+                os.lseek(self._fileno, offset, os.SEEK_SET)
+                while view:
+                    view = view[os.write(self._fileno, view):]
+
+    def save_journal(self):
+        """Sync the written data to disk and save the journal"""
+        if self.journal is None or not self.seekable:
+            return
+        # Only ranges written before the sync may be saved, so the snapshot is taken first
+        state = self.journal.snapshot()
+        os.fsync(self._fileno)
+        self.journal.save(state)
+
+    def writer(self, offset=0, buffer_size=None):
+        """A writer for the data starting at offset"""
+        return UMPRangeWriter(self, offset, buffer_size)
+
+    def truncate(self, size):
+        if self.seekable:
+            os.ftruncate(self._fileno, size)
+
+    def close(self):
+        try:
+            self.save_journal()
+        finally:
+            self.stream.close()
+
+
+class UMPRangeWriter:
+    """Writes consecutive media blocks to a UMPOutputFile, coalescing small blocks into larger writes"""
+
+    BUFFER_SIZE = 256 * 1024
+
+    def __init__(self, output: UMPOutputFile, offset=0, buffer_size=None):
+        self.output = output
+        self.buffer_size = buffer_size or self.BUFFER_SIZE
+        self._buffer = bytearray()
+        self._buffer_offset = offset
+
+    @property
+    def position(self):
+        """Offset in the file after the last byte written"""
+        return self._buffer_offset + len(self._buffer)
+
+    def write(self, data):
+        if not self._buffer and len(data) >= self.buffer_size:
+            self.output.write_at(self._buffer_offset, data)
+            self._buffer_offset += len(data)
+            return
+        self._buffer += data
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        self.output.write_at(self._buffer_offset, self._buffer)
+        self._buffer_offset += len(self._buffer)
+        self._buffer.clear()
+
+
+__all__ = ['UMPOutputFile', 'UMPRangeWriter']
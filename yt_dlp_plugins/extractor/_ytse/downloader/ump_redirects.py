@@ -0,0 +1,99 @@
+import collections
+import threading
+import time
+import urllib.parse
+
+from yt_dlp.utils import int_or_none, parse_qs, traverse_obj
+
+
+class UMPRedirectCache:
+    """
+    Process-wide cache of SABR redirects, keyed by video, host, itag, xtags and client.
+
+    Entries expire with the redirect URL (its expire parameter), or after MAX_AGE seconds if sooner.
+    The cache is persisted in the yt-dlp cache directory, so it also applies to later runs.
+    """
+
+    MAX_ENTRIES = 256
+    MAX_AGE = 6 * 60 * 60
+    # Redirects are not used when they are this close to expiring
+    EXPIRY_MARGIN = 60
+    _CACHE_SECTION = 'ytse'
+    _CACHE_KEY = 'ump_redirects'
+
+    def __init__(self):
+        # key -> (redirect_url, expires)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    @staticmethod
+    def key(url):
+        """The cache key for a format URL, or None if it is not known which format it is for"""
+        parsed = urllib.parse.urlparse(url)
+        qs = parse_qs(url)
+        video, itag = traverse_obj(qs, ('id', 0)), traverse_obj(qs, ('itag', 0))
+        if not (video and itag and parsed.netloc):
+            return None
+        # Audio tracks of different languages (or DRC) share an itag and only differ in xtags
+        xtags, client = traverse_obj(qs, ('xtags', 0)) or '', traverse_obj(qs, ('c', 0)) or ''
+        return f'{video}:{parsed.netloc}:{itag}:{xtags}:{client}'
+
+    def _load(self, ydl):
+        if self._loaded:
+            return
+        self._loaded = True
+        for key, (redirect_url, expires) in (ydl.cache.load(self._CACHE_SECTION, self._CACHE_KEY) or {}).items():
+            self._entries.setdefault(key, (redirect_url, expires))
+
+    def _save(self, ydl):
+        ydl.cache.store(self._CACHE_SECTION, self._CACHE_KEY, dict(self._entries))
+
+    def _prune(self):
+        now = time.time()
+        for key in [key for key, (_, expires) in self._entries.items() if expires <= now]:
+            del self._entries[key]
+        while len(self._entries) > self.MAX_ENTRIES:
+            self._entries.popitem(last=False)
+
+    def get(self, ydl, key):
+        """The cached redirect URL for key, if there is one that has not expired"""
+        if key is None:
+            return None
+        with self._lock:
+            self._load(ydl)
+            redirect_url, expires = self._entries.get(key, (None, 0))
+            if expires <= time.time():
+                return None
+            self._entries.move_to_end(key)
+            return redirect_url
+
+    def store(self, ydl, key, redirect_url):
+        if key is None:
+            return
+        now = time.time()
+        expires = now + self.MAX_AGE
+        url_expires = int_or_none(traverse_obj(parse_qs(redirect_url), ('expire', 0)))
+        if url_expires is not None:
+            expires = min(expires, url_expires - self.EXPIRY_MARGIN)
+        if expires <= now:
+            return
+        with self._lock:
+            self._load(ydl)
+            self._entries[key] = (redirect_url, expires)
+            self._entries.move_to_end(key)
+            self._prune()
+            self._save(ydl)
+
+    def remove(self, ydl, key):
+        """Forget the redirect for key, e.g. after it stopped working"""
+        with self._lock:
+            self._load(ydl)
+            if self._entries.pop(key, None) is not None:
+                self._save(ydl)
+
+
+redirect_cache = UMPRedirectCache()
+
+
+__all__ = ['UMPRedirectCache', 'redirect_cache']
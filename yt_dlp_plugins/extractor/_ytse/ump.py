@@ -1,65 +1,264 @@
 import base64
 import enum
+
+import protobug
 from yt_dlp.networking import Response
 
+from yt_dlp_plugins.extractor._ytse.protos.innertube.next_request_policy import NextRequestPolicy
+from yt_dlp_plugins.extractor._ytse.protos.innertube.playback_start_policy import PlaybackStartPolicy
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.allowed_cached_formats import AllowedCachedFormats
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.format_initialization_metadata import FormatInitializationMetadata
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.live_metadata import LiveMetadata
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.media_header import MediaHeader
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.network_timing import NetworkTiming
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.playback_debug_info import PlaybackDebugInfo
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.prewarm_connection import PrewarmConnection
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.reload_player_response import ReloadPlayerResponse
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.request_cancellation_policy import RequestCancellationPolicy
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.sabr_context_sending_policy import SabrContextSendingPolicy
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.sabr_context_update import SabrContextUpdate
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.sabr_error import SabrError
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.sabr_redirect import SabrRedirect
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.sabr_seek import SabrSeek
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.selectable_formats import SelectableFormats
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.snackbar_message import SnackbarMessage
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.stream_protection_status import StreamProtectionStatus
+from yt_dlp_plugins.extractor._ytse.protos.videostreaming.timeline_context import TimelineContext
+
+
+_NOT_DECODED = object()
+
 
 class UMPPart:
-    def __init__(self, part_id: int, size: int, data):
-        self.part_type = UMPPartType(part_id)
+    __slots__ = ('part_type', 'part_id', 'data', '_message')
+
+    def __init__(self, part_id: int, data):
+        self.part_type = _PART_TYPES.get(part_id, UMPPartType.UNKNOWN)
         self.part_id = part_id
-        self.size = size
         self.data = data
+        self._message = _NOT_DECODED
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
 
     def get_b64_str(self) -> str:
         return base64.b64encode(self.data).decode('utf-8')
 
+    @property
+    def message(self):
+        """
+        The payload decoded as the message registered for this part type, or None if there is none.
+        Decoded on first access only.
+        """
+        if self._message is _NOT_DECODED:
+            message_cls = UMP_PART_MESSAGES.get(self.part_type)
+            self._message = protobug.loads(self.data, message_cls) if message_cls else None
+        return self._message
 
-class UMPParser:
-    # TODO: Go over and clean this up, was generated without care
-    def __init__(self, response: Response):
-        self.response = response
 
-    def _read_varint(self) -> int:
-        def varint_size(byte: int) -> int:
-            lo = 0
-            for i in range(7, 3, -1):
-                if byte & (1 << i):
-                    lo += 1
-                else:
+# Number of bytes in a varint, indexed by its first byte
+_VARINT_SIZES = bytes(
+    5 if byte >= 0xF0 else 4 if byte >= 0xE0 else 3 if byte >= 0xC0 else 2 if byte >= 0x80 else 1
+    for byte in range(256))
+
+
+def _decode_varint(buffer, pos: int, end: int):
+    """Decode a varint from buffer at pos. Returns (value, new_pos), or (None, pos) if it is incomplete"""
+    if pos >= end:
+        return None, pos
+    prefix = buffer[pos]
+    size = _VARINT_SIZES[prefix]
+    if pos + size > end:
+        return None, pos
+    if size == 1:
+        return prefix, pos + 1
+    elif size == 2:
+        return (prefix & 0x3F) | (buffer[pos + 1] << 6), pos + 2
+    elif size == 3:
+        return (prefix & 0x1F) | (buffer[pos + 1] << 5) | (buffer[pos + 2] << 13), pos + 3
+    elif size == 4:
+        return (prefix & 0x0F) | (buffer[pos + 1] << 4) | (buffer[pos + 2] << 12) | (buffer[pos + 3] << 20), pos + 4
+    return int.from_bytes(buffer[pos + 1:pos + 5], 'little'), pos + 5
+
+
+def _encode_varint(value: int) -> bytes:
+    """Encode value with the same variable-length scheme read by _decode_varint"""
+    if value < 0:
+        raise ValueError(f'Cannot encode negative varint: {value}')
+    elif value < 0x80:
+        return bytes((value,))
+    elif value < 0x4000:
+        return bytes((0x80 | (value & 0x3F), value >> 6))
+    elif value < 0x200000:
+        return bytes((0xC0 | (value & 0x1F), (value >> 5) & 0xFF, value >> 13))
+    elif value < 0x10000000:
+        return bytes((0xE0 | (value & 0x0F), (value >> 4) & 0xFF, (value >> 12) & 0xFF, value >> 20))
+    elif value < 0x100000000:
+        return b'\xF0' + value.to_bytes(4, 'little')
+    raise ValueError(f'Varint too large to encode: {value}')
+
+
+class UMPWriter:
+    """Serializes parts into a UMP stream written to fp (any object with a write() method)"""
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    def write_part(self, part_type: int, data=b'') -> int:
+        header = _encode_varint(part_type) + _encode_varint(len(data))
+        self.fp.write(header)
+        self.fp.write(data)
+        return len(header) + len(data)
+
+    def write_message(self, part_type: int, message) -> int:
+        """Write a protobug message (e.g. MediaHeader, SabrRedirect) as the payload of a part"""
+        return self.write_part(part_type, protobug.dumps(message))
+
+    def write_media(self, header_id: int, data) -> int:
+        header_id = _encode_varint(header_id)
+        header = _encode_varint(UMPPartType.MEDIA) + _encode_varint(len(header_id) + len(data)) + header_id
+        self.fp.write(header)
+        self.fp.write(data)
+        return len(header) + len(data)
+
+    def write_media_end(self, header_id: int) -> int:
+        return self.write_part(UMPPartType.MEDIA_END, _encode_varint(header_id))
+
+
+class UMPPartChunk:
+    """
+    A piece of the payload of a streamed part.
+
+    data is a memoryview into the chunk that was fed to the decoder where possible,
+    so it is only valid for as long as that chunk is left unmodified.
+    """
+
+    __slots__ = ('part_type', 'part_id', 'size', 'offset', 'data')
+
+    def __init__(self, part_id: int, size: int, offset: int, data):
+        self.part_type = _PART_TYPES.get(part_id, UMPPartType.UNKNOWN)
+        self.part_id = part_id
+        self.size = size
+        self.offset = offset
+        self.data = data
+
+    @property
+    def is_first(self) -> bool:
+        return self.offset == 0
+
+    @property
+    def is_last(self) -> bool:
+        return self.offset + len(self.data) == self.size
+
+
+class UMPDecoder:
+    """
+    Incremental (sans-IO) UMP decoder.
+
+    Feed it arbitrary chunks of a UMP stream with feed() and it returns the parts completed by that chunk.
+    Part headers and payloads may be split across any number of chunks.
+
+    Parts with a type in stream_part_types are not buffered. Instead, their payload is returned
+    as a sequence of UMPPartChunk as it arrives, so large parts can be processed in constant memory.
+    """
+
+    def __init__(self, stream_part_types=()):
+        self.stream_part_types = frozenset(stream_part_types)
+        self._buffer = bytearray()
+        # (part_id, size, offset) of the streamed part currently being received
+        self._stream = None
+
+    def _feed_stream(self, view: memoryview, parts: list) -> memoryview:
+        part_id, size, offset = self._stream
+        length = min(len(view), size - offset)
+        parts.append(UMPPartChunk(part_id, size, offset, view[:length]))
+        offset += length
+        self._stream = (part_id, size, offset) if offset < size else None
+        return view[length:]
+
+    def feed(self, data) -> list:
+        parts = []
+        if self._stream is not None:
+            data = self._feed_stream(memoryview(data), parts)
+            if not data:
+                return parts
+
+        if self._buffer:
+            self._buffer += data
+            data = self._buffer
+
+        # Chunks of streamed parts reference the fed data directly, unless it is our own buffer
+        buffered = data is self._buffer
+        view = memoryview(data)
+        pos, end = 0, len(data)
+        try:
+            while True:
+                part_type, payload_start = _decode_varint(view, pos, end)
+                if part_type is None:
                     break
-            return min(lo + 1, 5)
+                part_size, payload_start = _decode_varint(view, payload_start, end)
+                if part_size is None:
+                    break
+
+                if part_type in self.stream_part_types:
+                    pos = min(end, payload_start + part_size)
+                    chunk = view[payload_start:pos]
+                    if buffered:
+                        chunk = bytes(chunk)
+                    if chunk or not part_size:
+                        parts.append(UMPPartChunk(part_type, part_size, 0, chunk))
+                    if pos - payload_start < part_size:
+                        self._stream = (part_type, part_size, pos - payload_start)
+                        break
+                    continue
 
-        next_byte = self.response.read(1)
+                if payload_start + part_size > end:
+                    break
+                pos = payload_start + part_size
+                parts.append(UMPPart(part_type, bytes(view[payload_start:pos])))
 
-        if len(next_byte) == 0:
-            self.response.close()
-            return 0
+            if not buffered:
+                self._buffer = bytearray(view[pos:])
+        finally:
+            if buffered:
+                view.release()
 
-        prefix = next_byte[0]
-        size = varint_size(prefix)
-        result = 0
-        shift = 0
+        if buffered:
+            del self._buffer[:pos]
+        return parts
 
-        if size != 5:
-            shift = 8 - size
-            mask = (1 << shift) - 1
-            result |= prefix & mask
+    def close(self) -> list:
+        """Signal the end of the stream. Returns the trailing part if the stream ended partway through its payload"""
+        buffer, self._buffer = self._buffer, bytearray()
+        self._stream = None
+        part_type, payload_start = _decode_varint(buffer, 0, len(buffer))
+        if part_type is not None:
+            part_size, payload_start = _decode_varint(buffer, payload_start, len(buffer))
+            if part_size is not None:
+                return [UMPPart(part_type, bytes(buffer[payload_start:]))]
+        return []
 
-        for i in range(1, size):
-            byte = self.response.read(1)[0]
-            result |= byte << shift
-            shift += 8
 
-        return result
+class UMPParser:
+    # Amount of data to read from the response at a time
+    READ_SIZE = 256 * 1024
+
+    def __init__(self, response: Response, read_size: int = READ_SIZE, stream_part_types=()):
+        self.response = response
+        self.read_size = read_size
+        self.stream_part_types = stream_part_types
 
     def iter_parts(self):
-        while not self.response.closed:
-            part_type = self._read_varint()
-            if self.response.closed:
+        decoder = UMPDecoder(self.stream_part_types)
+        while True:
+            data = self.response.read(self.read_size)
+            if not data:
                 break
-            part_size = self._read_varint()
-            part_data = self.response.read(part_size)
-            yield UMPPart(part_type, part_size, part_data)
+            yield from decoder.feed(data)
+
+        self.response.close()
+        yield from decoder.close()
 
 
 class UMPPartType(enum.IntEnum):
@@ -115,4 +314,47 @@ class UMPPartType(enum.IntEnum):
         return cls.UNKNOWN
 
 
-__all__ = ['UMPPart', 'UMPParser', 'UMPPartType']
\ No newline at end of file
+# Lookup table of part id -> UMPPartType, avoiding the enum constructor (and _missing_) per part
+_PART_TYPES = {part_type.value: part_type for part_type in UMPPartType}
+
+
+# Protobuf message type of the payload of each part type
+UMP_PART_MESSAGES = {
+    UMPPartType.MEDIA_HEADER: MediaHeader,
+    UMPPartType.LIVE_METADATA: LiveMetadata,
+    UMPPartType.NEXT_REQUEST_POLICY: NextRequestPolicy,
+    UMPPartType.FORMAT_INITIALIZATION_METADATA: FormatInitializationMetadata,
+    UMPPartType.SABR_REDIRECT: SabrRedirect,
+    UMPPartType.SABR_ERROR: SabrError,
+    UMPPartType.SABR_SEEK: SabrSeek,
+    UMPPartType.RELOAD_PLAYER_RESPONSE: ReloadPlayerResponse,
+    UMPPartType.PLAYBACK_START_POLICY: PlaybackStartPolicy,
+    UMPPartType.ALLOWED_CACHED_FORMATS: AllowedCachedFormats,
+    UMPPartType.SELECTABLE_FORMATS: SelectableFormats,
+    UMPPartType.REQUEST_CANCELLATION_POLICY: RequestCancellationPolicy,
+    UMPPartType.TIMELINE_CONTEXT: TimelineContext,
+    UMPPartType.SABR_CONTEXT_UPDATE: SabrContextUpdate,
+    UMPPartType.STREAM_PROTECTION_STATUS: StreamProtectionStatus,
+    UMPPartType.SABR_CONTEXT_SENDING_POLICY: SabrContextSendingPolicy,
+    UMPPartType.PREWARM_CONNECTION: PrewarmConnection,
+    UMPPartType.PLAYBACK_DEBUG_INFO: PlaybackDebugInfo,
+    UMPPartType.SNACKBAR_MESSAGE: SnackbarMessage,
+    UMPPartType.NETWORK_TIMING: NetworkTiming,
+}
+
+
+def register_part_message(part_type: int, message_cls):
+    """Register (or replace) the protobuf message type used to decode UMPPart.message for a part type"""
+    UMP_PART_MESSAGES[part_type] = message_cls
+
+
+__all__ = [
+    'UMP_PART_MESSAGES',
+    'UMPPart',
+    'UMPPartChunk',
+    'UMPDecoder',
+    'UMPParser',
+    'UMPPartType',
+    'UMPWriter',
+    'register_part_message',
+]
\ No newline at end of file
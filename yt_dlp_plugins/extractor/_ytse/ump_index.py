@@ -0,0 +1,140 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from yt_dlp_plugins.extractor._ytse.ump import UMPPart, _decode_varint
+
+
+class UMPIndex:
+    """
+    Random access to the parts of a raw UMP file (e.g. a response dump).
+
+    The file is memory-mapped and scanned once to build a compact index of
+    (part id, payload offset, payload size) for each part. The index can be saved
+    to a sidecar file next to the dump so later opens do not need to re-scan it.
+    """
+
+    SIDECAR_SUFFIX = '.umpidx'
+    _MAGIC = b'YTSEUMPI'
+    # magic, version, source file size, source file mtime (ns), number of parts
+    _HEADER = struct.Struct('<8sIQqQ')
+    _VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.part_ids = array('I')
+        self.offsets = array('Q')
+        self.sizes = array('I')
+        self._type_indices = None
+        self._file = open(path, 'rb')
+        stat = os.fstat(self._file.fileno())
+        self._source_key = (stat.st_size, stat.st_mtime_ns)
+        # mmap does not support empty files
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b''
+
+    @classmethod
+    def open(cls, path, use_sidecar=True):
+        """Open a UMP file, loading the index from its sidecar if it is up to date, or building (and saving) it"""
+        index = cls(path)
+        if not use_sidecar:
+            index.build()
+        elif not index.load():
+            index.build()
+            try:
+                index.save()
+            except OSError:
+                pass
+        return index
+
+    @property
+    def sidecar_path(self):
+        return f'{self.path}{self.SIDECAR_SUFFIX}'
+
+    def build(self):
+        """Scan the file once, recording the position of every part without reading the payloads"""
+        part_ids, offsets, sizes = array('I'), array('Q'), array('I')
+        buffer, pos, end = self._mmap, 0, len(self._mmap)
+        while True:
+            part_id, payload_start = _decode_varint(buffer, pos, end)
+            if part_id is None:
+                break
+            part_size, payload_start = _decode_varint(buffer, payload_start, end)
+            if part_size is None:
+                break
+            part_ids.append(part_id)
+            offsets.append(payload_start)
+            sizes.append(part_size)
+            pos = payload_start + part_size
+        self.part_ids, self.offsets, self.sizes = part_ids, offsets, sizes
+        self._type_indices = None
+
+    def save(self, path=None):
+        arrays = (self.part_ids, self.offsets, self.sizes)
+        if sys.byteorder != 'little':
+            arrays = [array(a.typecode, a) for a in arrays]
+            for a in arrays:
+                a.byteswap()
+        with open(path or self.sidecar_path, 'wb') as f:
+            f.write(self._HEADER.pack(self._MAGIC, self._VERSION, *self._source_key, len(self)))
+            for a in arrays:
+                a.tofile(f)
+
+    def load(self, path=None) -> bool:
+        """Load the index from a sidecar file. Returns False if it is missing or does not match the UMP file"""
+        try:
+            with open(path or self.sidecar_path, 'rb') as f:
+                magic, version, size, mtime_ns, count = self._HEADER.unpack(f.read(self._HEADER.size))
+                if (magic, version, (size, mtime_ns)) != (self._MAGIC, self._VERSION, self._source_key):
+                    return False
+                arrays = array('I'), array('Q'), array('I')
+                for a in arrays:
+                    a.fromfile(f, count)
+        except (OSError, EOFError, struct.error):
+            return False
+
+        if sys.byteorder != 'little':
+            for a in arrays:
+                a.byteswap()
+        self.part_ids, self.offsets, self.sizes = arrays
+        self._type_indices = None
+        return True
+
+    def __len__(self):
+        return len(self.part_ids)
+
+    def __getitem__(self, index: int) -> UMPPart:
+        offset = self.offsets[index]
+        return UMPPart(self.part_ids[index], self._mmap[offset:offset + self.sizes[index]])
+
+    def __iter__(self):
+        return self.iter_parts()
+
+    def indices(self, part_type=None):
+        """Indices of all parts, or only those of the given part type"""
+        if part_type is None:
+            return range(len(self))
+        if self._type_indices is None:
+            self._type_indices = {}
+            for i, part_id in enumerate(self.part_ids):
+                self._type_indices.setdefault(part_id, array('Q')).append(i)
+        return self._type_indices.get(part_type, ())
+
+    def iter_parts(self, part_type=None):
+        for i in self.indices(part_type):
+            yield self[i]
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+__all__ = ['UMPIndex']
@@ -40,6 +40,8 @@ class _YTSE(YoutubeIE, plugin_name='YTSE'):
                     continue
                 format_copy = f.copy()
                 format_copy['protocol'] = 'ump'
+                # UMP follows live streams itself; keep --live-from-start from converting it to a DASH fragment generator
+                format_copy.pop('is_from_start', None)
                 format_copy['url'] = update_url_query(format_copy['url'], {'ump': 1, 'srfvp': 1})
                 ump_formats.append(format_copy)
 